@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import get_data
+
+"""
+Fetch GetMatchDetails for many matches concurrently.
+
+Requests are made with a pooled requests.Session from a thread pool driven by asyncio. A token bucket limits the request rate of all of them together and every request is retried with exponential backoff and jitter.
+"""
+
+details_url = "https://api.steampowered.com/IDOTA2Match_570/GetMatchDetails/V001/"
+
+class TokenBucket:
+	"""Allows rate acquisitions per second on average and bursts of up to capacity. Only used from one event loop, so it needs no lock."""
+	def __init__(self, rate, capacity=1):
+		self.rate = rate
+		self.capacity = capacity
+		self.tokens = capacity
+		self.last = time.monotonic()
+	async def acquire(self):
+		while True:
+			now = time.monotonic()
+			self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+			self.last = now
+			if self.tokens >= 1:
+				self.tokens -= 1
+				return
+			await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class RetryableError(Exception):
+	pass
+
+class DetailsFetcher:
+	"""
+	Fetches match details with at most concurrency requests in flight and at most rate requests per second.
+
+	Connection errors, invalid responses, 429 and 5xx answers are retried up to max_tries times. The n-th retry waits a random time between 0 and min(max_delay, base_delay * 2**n) seconds.
+	"""
+	def __init__(self, api_key, concurrency=8, rate=5.0, burst=1, max_tries=5, base_delay=1.0, max_delay=60.0, url=details_url, timeout=10):
+		self.api_key = api_key
+		self.concurrency = concurrency
+		self.bucket = TokenBucket(rate, burst)
+		self.max_tries = max_tries
+		self.base_delay = base_delay
+		self.max_delay = max_delay
+		self.url = url
+		self.timeout = timeout
+		self.session = requests.Session()
+		adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+		self.session.mount("http://", adapter)
+		self.session.mount("https://", adapter)
+		self.executor = ThreadPoolExecutor(concurrency)
+		self.fetched = 0
+		self.failed = 0
+		self.retries = 0
+	def close(self):
+		self.executor.shutdown()
+		self.session.close()
+	def get(self, match_id):
+		"""Blocking request for the details of one match. Returns None if the api does not know the match."""
+		try:
+			response = self.session.get(self.url, params={"match_id": match_id, "key": self.api_key}, timeout=self.timeout)
+		# the messages of requests contain the url with the api key, so only the type of the error is passed on
+		except requests.exceptions.RequestException as e:
+			raise RetryableError(type(e).__name__)
+		if response.status_code == 429 or response.status_code >= 500:
+			raise RetryableError("HTTP {}".format(response.status_code))
+		response.raise_for_status()
+		try:
+			result = response.json()["result"]
+		except (ValueError, KeyError) as e:
+			raise RetryableError("Invalid response: {}".format(e))
+		if "error" in result:
+			logging.warning("MatchDetails error for matchid {}: {}".format(match_id, result["error"]))
+			return None
+		return result
+	async def fetch(self, match_id):
+		loop = asyncio.get_running_loop()
+		for attempt in range(self.max_tries):
+			await self.bucket.acquire()
+			try:
+				return await loop.run_in_executor(self.executor, self.get, match_id)
+			except RetryableError as e:
+				logging.warning("Api or timeout error in MatchDetails on matchid {} on try {}: {}".format(match_id, attempt + 1, e))
+				if attempt + 1 < self.max_tries:
+					self.retries += 1
+					await asyncio.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt)))
+			except requests.exceptions.HTTPError as e:
+				logging.warning("MatchDetails request for matchid {} failed: HTTP {}".format(match_id, e.response.status_code))
+				break
+		return None
+	async def fetch_all(self, match_ids, on_result):
+		"""Fetch the details of all match ids and call on_result with every result. Returns the number of results of this call, fetched counts those of all calls."""
+		ids = asyncio.Queue()
+		for match_id in match_ids:
+			ids.put_nowait(match_id)
+		fetched = [0]
+		async def work():
+			while not ids.empty():
+				match_id = ids.get_nowait()
+				result = await self.fetch(match_id)
+				if result is None:
+					self.failed += 1
+				else:
+					self.fetched += 1
+					fetched[0] += 1
+					on_result(result)
+		await asyncio.gather(*(work() for _ in range(self.concurrency)))
+		return fetched[0]
+
+def do_async_match_details(database, fetcher, writer=None):
+	"""Like get_data.do_match_details but fetches concurrently with the given DetailsFetcher."""
+	match_ids = get_data.incomplete_match_ids(database, writer)
+	fetched = asyncio.run(fetcher.fetch_all(match_ids, lambda match: get_data.update_match_details(database, match, writer)))
+	print("Added details for {} of {} matches.".format(fetched, len(match_ids)))
+	return fetched
\ No newline at end of file
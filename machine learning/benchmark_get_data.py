@@ -0,0 +1,146 @@
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock
+from urllib.parse import urlparse, parse_qs
+
+import async_details
+import get_data
+
+"""
+Benchmarks of get_data.py.
+
+Writing matches to the database with get_data.MatchWriter is compared against one connection per match, and async_details.py is run with different concurrency limits.
+The dota2 api is replaced by FakeApi and StubApiServer, so no api key or network connection is needed.
+"""
+
+class FakeApi:
+	"""Returns GetMatchHistory pages and GetMatchDetails results shaped like those of dota2api in raw mode."""
+	def __init__(self, matches, page_size=100, seed=0):
+		self.random = random.Random(seed)
+		self.page_size = page_size
+		self.first_match_id = 3000000000
+		self.matches = [self.make_match(self.first_match_id + i) for i in range(matches)]
+	def make_match(self, match_id):
+		heroes = self.random.sample(range(1, 100), 10)
+		players = [{"player_slot": slot, "hero_id": hero, "leaver_status": 0} for slot, hero in zip([0, 1, 2, 3, 4, 128, 129, 130, 131, 132], heroes)]
+		return {"match_id": match_id, "start_time": 1500000000 + match_id - self.first_match_id, "lobby_type": 7, "players": players, "game_mode": 22, "duration": self.random.randint(900, 4000), "radiant_win": self.random.random() < 0.5}
+	def get_match_history(self, start_at_match_id=None, **kwargs):
+		# newest matches first, like the real api
+		end = len(self.matches) if start_at_match_id is None else start_at_match_id - self.first_match_id + 1
+		page = self.matches[max(0, end - self.page_size):end][::-1]
+		return {"matches": page, "results_remaining": max(0, end - self.page_size)}
+	def get_match_details(self, match_id):
+		return self.matches[match_id - self.first_match_id]
+
+class StubApiServer:
+	"""
+	Local HTTP server that answers GetMatchDetails requests like the steam web api, with the matches of a FakeApi.
+	
+	Every answer is delayed by latency seconds and a share of error_rate of the requests fails with HTTP 503.
+	"""
+	def __init__(self, fake_api, latency=0.0, error_rate=0.0, seed=0):
+		stub = self
+		self.fake_api = fake_api
+		self.latency = latency
+		self.error_rate = error_rate
+		self.random = random.Random(seed)
+		self.lock = Lock()
+		self.requests = 0
+		self.errors = 0
+		class Handler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				query = parse_qs(urlparse(self.path).query)
+				with stub.lock:
+					stub.requests += 1
+					fail = stub.random.random() < stub.error_rate
+					if fail: stub.errors += 1
+				time.sleep(stub.latency)
+				if fail:
+					self.send_response(503)
+					self.end_headers()
+					return
+				index = int(query["match_id"][0]) - stub.fake_api.first_match_id
+				if "key" not in query:
+					self.send_response(403)
+					self.end_headers()
+					return
+				if 0 <= index < len(stub.fake_api.matches):
+					result = stub.fake_api.matches[index]
+				else:
+					result = {"error": "Match ID not found"}
+				body = json.dumps({"result": result}).encode()
+				self.send_response(200)
+				self.send_header("Content-Type", "application/json")
+				self.send_header("Content-Length", str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+			def log_message(self, format, *args):
+				pass
+		self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+		self.url = "http://127.0.0.1:{}/IDOTA2Match_570/GetMatchDetails/V001/".format(self.server.server_address[1])
+		self.thread = Thread(target=self.server.serve_forever)
+		self.thread.daemon = True
+	def start(self):
+		self.thread.start()
+	def stop(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+def run_async(database, matches, concurrency, latency, error_rate):
+	"""Gather the history of a FakeApi, then fetch the details from a StubApiServer with async_details. Returns (seconds for details, fetcher, server)."""
+	get_data.create_db(database)
+	get_data.api = FakeApi(matches)
+	writer = get_data.MatchWriter(database)
+	writer.start()
+	get_data.do_match_history(database, writer=writer)
+	server = StubApiServer(get_data.api, latency=latency, error_rate=error_rate)
+	server.start()
+	fetcher = async_details.DetailsFetcher("stub key", concurrency=concurrency, rate=10000, base_delay=0.05, url=server.url)
+	start = time.perf_counter()
+	async_details.do_async_match_details(database, fetcher, writer=writer)
+	writer.close()
+	duration = time.perf_counter() - start
+	fetcher.close()
+	server.stop()
+	return (duration, fetcher, server)
+
+def run(database, matches, use_writer):
+	"""Gather all matches and their details from a FakeApi into a new database. Returns (seconds for history, seconds for details)."""
+	get_data.create_db(database)
+	get_data.api = FakeApi(matches)
+	writer = None
+	if use_writer:
+		writer = get_data.MatchWriter(database)
+		writer.start()
+	start = time.perf_counter()
+	get_data.do_match_history(database, writer=writer)
+	if writer is not None:
+		writer.flush()
+	history = time.perf_counter() - start
+	start = time.perf_counter()
+	get_data.do_match_details(database, writer=writer, delay=0)
+	if writer is not None:
+		writer.close()
+	details = time.perf_counter() - start
+	return (history, details)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--matches", type=int, default=5000)
+	parser.add_argument("--details-matches", type=int, default=500)
+	parser.add_argument("--latency", type=float, default=0.05, help="Seconds the stub server takes to answer a details request.")
+	parser.add_argument("--error-rate", type=float, default=0.1, help="Share of details requests the stub server fails.")
+	args = parser.parse_args()
+	for use_writer in (False, True):
+		with tempfile.TemporaryDirectory() as directory:
+			(history, details) = run(os.path.join(directory, "matches.sqlite"), args.matches, use_writer)
+		print("{}: {:.0f} inserts/s, {:.0f} updates/s".format("MatchWriter" if use_writer else "connection per match", args.matches / history, args.matches / details))
+	for concurrency in (1, 8, 32):
+		with tempfile.TemporaryDirectory() as directory:
+			(duration, fetcher, server) = run_async(os.path.join(directory, "matches.sqlite"), args.details_matches, concurrency, args.latency, args.error_rate)
+		print("async details with concurrency {}: {:.0f} matches/s, {} requests, {} retries, {} failed".format(concurrency, fetcher.fetched / duration, server.requests, fetcher.retries, fetcher.failed))
\ No newline at end of file
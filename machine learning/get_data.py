@@ -3,8 +3,9 @@ import sqlite3
 import time
 import json
 import logging
+import queue
 from pathlib import Path
-from threading import Thread
+from threading import Thread, Event
 
 
 import dota2api
@@ -36,9 +37,142 @@ def create_db(filename):
 		)")
 	connection.commit()
 	connection.close()
+	create_crawler_state(filename)
+	create_match_log(filename)
+
+def create_crawler_state(filename):
+	"""Create the table in which the MatchHistory crawler keeps its position. Also used to add it to databases created before it existed."""
+	connection = sqlite3.connect(filename, timeout=10)
+	connection.execute("CREATE TABLE IF NOT EXISTS crawler_state (name TEXT PRIMARY KEY, value INTEGER)")
+	connection.commit()
+	connection.close()
+
+def create_match_log(filename):
+	"""
+	Create the completed_matches log, which triggers on matches fill with the id of every match that becomes complete (gets radiant_win), in that order.
+	Also used to add it to databases created before it existed, their complete matches are logged once when it is added.
+	
+	Readers like match_store.py remember the last seq they have read to find the matches that are new to them. Match ids can not be used for this because
+	the MatchHistory crawler adds older matches after newer ones and details arrive in any order.
+	"""
+	connection = sqlite3.connect(filename, timeout=10, isolation_level=None)
+	connection.execute("BEGIN IMMEDIATE")
+	if connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'completed_matches'").fetchone() is None:
+		connection.execute("CREATE TABLE completed_matches (seq INTEGER PRIMARY KEY AUTOINCREMENT, match_id INTEGER NOT NULL)")
+		connection.execute("CREATE TRIGGER IF NOT EXISTS log_completed_insert AFTER INSERT ON matches WHEN new.radiant_win IS NOT NULL BEGIN INSERT INTO completed_matches (match_id) VALUES (new.match_id); END")
+		connection.execute("CREATE TRIGGER IF NOT EXISTS log_completed_update AFTER UPDATE OF radiant_win ON matches WHEN old.radiant_win IS NULL AND new.radiant_win IS NOT NULL BEGIN INSERT INTO completed_matches (match_id) VALUES (new.match_id); END")
+		connection.execute("INSERT INTO completed_matches (match_id) SELECT match_id FROM matches WHERE radiant_win IS NOT NULL ORDER BY match_id")
+	connection.execute("COMMIT")
+	connection.close()
+
+def load_crawler_state(database):
+	connection = sqlite3.connect(database, timeout=10)
+	state = dict(connection.execute("SELECT name, value FROM crawler_state").fetchall())
+	connection.close()
+	return state
+
+save_crawler_state_statement = "INSERT OR REPLACE INTO crawler_state VALUES (?, ?)"
+	
+class MatchWriter:
+	"""
+	Owns the one connection that writes to the database and writes the matches of the MatchHistory and MatchDetails threads in batches.
+	
+	Inserts and updates are queued and written with executemany in one transaction once batch_size of them are waiting or flush_interval seconds have passed.
+	The database is switched to WAL mode so that reading it does not block the writer.
+	
+	A batch that can not be written is logged instead of stopping the writer. If the database was locked it is kept and tried again with the next batch,
+	after any other error it is dropped and counted in failed. flush and close return even if the last write failed.
+	"""
+	insert_statement = "INSERT OR IGNORE INTO matches values (?,?,?,?,?,?,?,?,?,?,?,?,?,null,null,null,null)"
+	update_statement = "UPDATE OR IGNORE matches SET game_mode=?, has_leaver=?, duration=?, radiant_win=? WHERE match_id=?"
+	def __init__(self, database, batch_size=500, flush_interval=5.0):
+		self.database = database
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+		self.queue = queue.Queue()
+		self.thread = Thread(target=self.run)
+		self.thread.daemon = True
+		self.written = 0
+		self.failed = 0
+	def start(self):
+		self.thread.start()
+	def insert(self, values):
+		self.queue.put(("insert", values))
+	def update(self, values):
+		self.queue.put(("update", values))
+	def execute(self, statement, values):
+		"""Queue any other statement. It is executed after the inserts and updates queued before it, in the same transaction."""
+		self.queue.put(("execute", (statement, values)))
+	def flush(self):
+		"""Block until everything queued so far is written or the attempt to write it failed."""
+		done = Event()
+		self.queue.put(("flush", done))
+		done.wait()
+	def close(self):
+		self.queue.put(("close", None))
+		self.thread.join()
+	def write(self, connection, inserts, updates, statements):
+		"""Write a batch in one transaction. Returns False if it should be tried again because the database was locked."""
+		try:
+			with connection:
+				# inserts first so that updates in the same batch find their rows
+				connection.executemany(self.insert_statement, inserts)
+				connection.executemany(self.update_statement, updates)
+				for (statement, values) in statements:
+					connection.execute(statement, values)
+		except Exception as e:
+			if isinstance(e, sqlite3.OperationalError) and "locked" in str(e):
+				logging.error("Could not write {} matches, trying again with the next batch: {}".format(len(inserts) + len(updates), e))
+				return False
+			logging.exception("Dropping {} matches and {} other statements that could not be written: {}".format(len(inserts) + len(updates), len(statements), e))
+			self.failed += len(inserts) + len(updates)
+			return True
+		self.written += len(inserts) + len(updates)
+		return True
+	def run(self):
+		connection = sqlite3.connect(self.database, timeout=10)
+		try:
+			connection.execute("PRAGMA journal_mode=WAL")
+		except sqlite3.OperationalError as e:
+			logging.warning("Could not switch the database to WAL mode: {}".format(e))
+		inserts = list()
+		updates = list()
+		statements = list()
+		deadline = time.monotonic() + self.flush_interval
+		while True:
+			try:
+				(kind, item) = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+			except queue.Empty:
+				(kind, item) = (None, None)
+			if kind == "insert":
+				inserts.append(item)
+			elif kind == "update":
+				updates.append(item)
+			elif kind == "execute":
+				statements.append(item)
+			if kind in ("flush", "close") or len(inserts) + len(updates) + len(statements) >= self.batch_size or time.monotonic() >= deadline:
+				if len(inserts) + len(updates) + len(statements) != 0 and self.write(connection, inserts, updates, statements):
+					(inserts, updates, statements) = (list(), list(), list())
+				deadline = time.monotonic() + self.flush_interval
+				if kind == "flush":
+					item.set()
+				elif kind == "close":
+					if len(inserts) + len(updates) + len(statements) != 0:
+						logging.error("Closing with {} matches that could not be written.".format(len(inserts) + len(updates)))
+					break
+		connection.close()
+
+def do_match_history(database, lobby_types=[0, 2, 5, 6, 7], skill=3, tournament_games_only=False, writer=None):
+	"""
+	Gather information about recent matches as returned by GetMatchHistory.
+	
+	Pages are requested from the newest match backwards until a page reaches the newest match id of the previous pass, so only new matches cost api calls.
+	That match id and the position of an unfinished pass are kept in the crawler_state table. An interrupted pass continues from where it stopped the next time.
 	
-def do_match_history(database, lobby_types=[0, 2, 5, 6, 7], skill=3, tournament_games_only=False):
-	"""Gather information about recent matches as returned by GetMatchHistory."""
+	Matches are written through the writer if one is given, otherwise every match opens its own connection. With a writer the crawler state is written in the same transaction as the matches before it.
+	
+	Returns the number of new matches and of matches that were already stored.
+	"""
 	def add_match_to_db(match):
 		radiant_heroes = list()
 		dire_heroes = list()
@@ -54,15 +188,44 @@ def do_match_history(database, lobby_types=[0, 2, 5, 6, 7], skill=3, tournament_
 		# Skip matches where a player didnt pick a hero
 		if 0 in radiant_heroes or 0 in dire_heroes:
 			logging.info("Skipping {} because of 0 hero.".format(match["match_id"]))
-			return
+			return False
+		values = (match["match_id"], match["start_time"], match["lobby_type"]) + tuple(radiant_heroes) + tuple(dire_heroes)
+		if writer is not None:
+			writer.insert(values)
+			return True
 		connection = sqlite3.connect(database, timeout=10)
-		connection.execute("INSERT OR IGNORE INTO matches values (?,?,?,?,?,?,?,?,?,?,?,?,?,null,null,null,null)",
-		(match["match_id"], match["start_time"], match["lobby_type"]) + tuple(radiant_heroes) + tuple(dire_heroes))
+		connection.execute(MatchWriter.insert_statement, values)
 		connection.commit()
 		connection.close()
+		return True
+	def stored_match_ids(match_ids):
+		if writer is not None:
+			writer.flush()
+		connection = sqlite3.connect(database, timeout=10)
+		stored = connection.execute("SELECT match_id FROM matches WHERE match_id IN ({})".format(",".join("?" * len(match_ids))), match_ids).fetchall()
+		connection.close()
+		return set(match_id for (match_id,) in stored)
+	def save_state(values):
+		for name, value in values.items():
+			if writer is not None:
+				writer.execute(save_crawler_state_statement, (name, value))
+			else:
+				connection = sqlite3.connect(database, timeout=10)
+				connection.execute(save_crawler_state_statement, (name, value))
+				connection.commit()
+				connection.close()
 
-	start_at_match_id = None
-	matches = 0
+	create_crawler_state(database)
+	state = load_crawler_state(database)
+	# newest match id of the last finished pass
+	high_water = state.get("history_high_water")
+	# start_at_match_id of the next page and newest match id of an unfinished pass
+	start_at_match_id = state.get("history_cursor")
+	newest = state.get("history_pass_newest")
+	if start_at_match_id is not None:
+		logging.info("Resuming MatchHistory pass at {}.".format(start_at_match_id))
+	new = 0
+	duplicates = 0
 	while True:
 		tries = 0
 		while tries < 3:
@@ -75,30 +238,61 @@ def do_match_history(database, lobby_types=[0, 2, 5, 6, 7], skill=3, tournament_
 				time.sleep(30)
 				continue
 		if tries == 3:
-			return
-		if result["results_remaining"] == 0:
+			return (new, duplicates)
+		page = result["matches"]
+		if len(page) == 0:
 			break
-		start_at_match_id = result["matches"][-1]["match_id"] - 1
-		for match in result["matches"]:
+		match_ids = [match["match_id"] for match in page]
+		newest = max(match_ids + ([newest] if newest is not None else []))
+		stored = stored_match_ids(match_ids)
+		for match in page:
 			if len(match["players"]) == 10 and match["lobby_type"] in lobby_types:
-				add_match_to_db(match)
-				matches += 1
-	print("Added", matches, "matches.")
+				if match["match_id"] in stored:
+					duplicates += 1
+				elif add_match_to_db(match):
+					new += 1
+		if result["results_remaining"] == 0 or (high_water is not None and min(match_ids) <= high_water):
+			break
+		start_at_match_id = min(match_ids) - 1
+		save_state({"history_cursor": start_at_match_id, "history_pass_newest": newest})
+	if newest is not None:
+		save_state({"history_high_water": max(newest, high_water or 0), "history_cursor": None, "history_pass_newest": None})
+	if writer is not None:
+		writer.flush()
+	print("Added", new, "new matches,", duplicates, "were already stored.")
+	return (new, duplicates)
 
-def do_match_details(database):
-	"""Updated match ids which have incomplete information in the database. This is needed because GetMatchHistory does not deliver all needed information."""
-	def update_match_in_db(match):
-		has_leavers = False
-		for p in match["players"]:
-			if p["leaver_status"] in [2, 3, 4, 5, 6]: has_leavers = True
-		connection = sqlite3.connect(database, timeout=10)
-		connection.execute("UPDATE OR IGNORE matches SET game_mode=?, has_leaver=?, duration=?, radiant_win=? WHERE match_id=?", (match["game_mode"], has_leavers, match["duration"], match["radiant_win"], match["match_id"]))
-		connection.commit()
-		connection.close()
+def update_match_details(database, match, writer=None):
+	"""Store the details of a match as returned by GetMatchDetails, through the writer if one is given."""
+	has_leavers = False
+	for p in match["players"]:
+		if p["leaver_status"] in [2, 3, 4, 5, 6]: has_leavers = True
+	values = (match["game_mode"], has_leavers, match["duration"], match["radiant_win"], match["match_id"])
+	if writer is not None:
+		writer.update(values)
+		return
+	connection = sqlite3.connect(database, timeout=10)
+	connection.execute(MatchWriter.update_statement, values)
+	connection.commit()
+	connection.close()
+
+def incomplete_match_ids(database, writer=None):
+	"""Ids of the matches whose details are missing."""
+	if writer is not None:
+		# queued updates would otherwise make us fetch the same details again
+		writer.flush()
 	connection = sqlite3.connect(database, timeout=10)
 	matches = connection.execute("SELECT match_id FROM matches WHERE radiant_win IS NULL").fetchall()
 	connection.close()
-	for (match_id,) in matches:
+	return [match_id for (match_id,) in matches]
+
+def do_match_details(database, writer=None, delay=1):
+	"""
+	Updated match ids which have incomplete information in the database. This is needed because GetMatchHistory does not deliver all needed information.
+	
+	Like in do_match_history updates are written through the writer if one is given.
+	"""
+	for match_id in incomplete_match_ids(database, writer):
 		try:
 			result = api.get_match_details(match_id=match_id)
 		except (requests.exceptions.ConnectionError, json.decoder.JSONDecodeError, dota2api.src.exceptions.APIError, dota2api.src.exceptions.APITimeoutError):
@@ -106,13 +300,16 @@ def do_match_details(database):
 			time.sleep(30)
 			continue
 		print("Added details for {}.".format(result["match_id"]))
-		update_match_in_db(result)
-		time.sleep(1)
+		update_match_details(database, result, writer)
+		time.sleep(delay)
 
 if __name__ == "__main__":
 	parser = argparse.ArgumentParser(description="Continually gather new matches from the dota2 api and store them in an sqlite3 database. Use ctrl-c to quite the program at any time.")
 	parser.add_argument("--database", help="Database to store matches in. Will be created if file doesnt already exist.", required=True)
 	parser.add_argument("--api-key", help="Steam api key used for the api requests. Get one at https://steamcommunity.com/dev/apikey .", required=True)
+	parser.add_argument("--concurrency", type=int, default=0, help="Fetch match details with this many concurrent requests (see async_details.py). 0 fetches them one at a time.")
+	parser.add_argument("--rate", type=float, default=1.0, help="Maximum number of match details requests per second when --concurrency is used.")
+	parser.add_argument("--store", help="Optional binary match store (see match_store.py) that complete matches are appended to after every MatchDetails pass. Needs numpy.")
 	args = parser.parse_args()
 	
 	path = Path(args.database)
@@ -123,20 +320,33 @@ if __name__ == "__main__":
 		raise RuntimeError("Database is not a file.")
 	else:
 		logging.info("Using existing database.")
+		create_match_log(args.database)
 
 	api = dota2api.Initialise(args.api_key, raw_mode=True)
-	
+	writer = MatchWriter(args.database)
+	writer.start()
 	
 	def match_history():
 		while True:
-			do_match_history(args.database)
+			do_match_history(args.database, writer=writer)
 			time.sleep(60)
 	match_history_thread = Thread(target=match_history)
 	match_history_thread.daemon = True
 	
+	if args.store is not None:
+		import match_store
+	if args.concurrency > 0:
+		import async_details
+		fetcher = async_details.DetailsFetcher(args.api_key, concurrency=args.concurrency, rate=args.rate)
 	def match_details():
 		while True:
-			do_match_details(args.database)
+			if args.concurrency > 0:
+				async_details.do_async_match_details(args.database, fetcher, writer=writer)
+			else:
+				do_match_details(args.database, writer=writer)
+			if args.store is not None:
+				writer.flush()
+				print("Appended", match_store.append_from_database(args.database, args.store), "matches to the store.")
 			time.sleep(60)
 	match_details_thread = Thread(target=match_details)
 	match_details_thread.daemon = True
@@ -145,5 +355,9 @@ if __name__ == "__main__":
 	match_history_thread.start()
 	match_details_thread.start()
 	# This is needed (instead of joining the threads) to respond to crl-c
-	while True:
-		time.sleep(1)
\ No newline at end of file
+	try:
+		while True:
+			time.sleep(1)
+	except KeyboardInterrupt:
+		# write what is still queued
+		writer.flush()
\ No newline at end of file
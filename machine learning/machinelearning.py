@@ -9,89 +9,133 @@ from sklearn.neural_network import MLPClassifier
 from sklearn import preprocessing
 import math
 import time
+import scipy.sparse
 
-from sklearn.externals import joblib
+# sklearn.externals.joblib was removed in scikit-learn 0.23
+try:
+	from sklearn.externals import joblib
+except ImportError:
+	import joblib
 
 import simple_heroes
+import match_store
 
 import sqlite3
 import os
 import os.path
+# only used to report peak memory, not available on Windows
+try:
+	import resource
+except ImportError:
+	resource = None
 
+# Hero columns of the matches table in feature order and the condition for matches that can be used for training.
+hero_columns = 'radiant_hero_1,radiant_hero_2,radiant_hero_3,radiant_hero_4,radiant_hero_5, dire_hero_1,dire_hero_2,dire_hero_3,dire_hero_4,dire_hero_5'
+usable_matches = 'radiant_win IS NOT NULL AND has_leaver = 0 AND radiant_hero_1 != 0 AND radiant_hero_2 != 0 AND radiant_hero_3 != 0 AND radiant_hero_4 != 0 AND radiant_hero_5 != 0 AND dire_hero_1 != 0 AND dire_hero_2 != 0 AND dire_hero_3 != 0 AND dire_hero_4 != 0 AND dire_hero_5 != 0'
 
-def load_data(database, undersample=True):
+def load_data(database, undersample=True, sparse=False, chunk_size=100000, verbose=False):
 	"""
 	Load data from a sqlite3 database and convert the matches into feature vectors in form of numpy arrays.
 	
-	Optionally perform undersampling to get the same number of samples of both classes.
+	Optionally perform undersampling to get the same number of samples of both classes. The first matches of each class in database order are kept.
+	
+	The matches are read in a single scan, chunk_size rows at a time, into a small integer array of hero ids. The features are then built from it with vectorized operations, see heroes_to_features.
+	With sparse the features are a scipy.sparse CSR matrix, otherwise a dense uint8 array. Some models (for example KNeighborsClassifier with ball_tree) do not accept sparse input.
+	
+	With verbose the number of rows read per second and the peak memory use of the process are printed.
 	
 	This method can be used directly, or indirectly via make_training_validate_test.
 	"""
+	start = time.time()
 	connection = sqlite3.connect(database)
-	if undersample:
-		number_of_radiant_wins = connection.execute('SELECT COUNT(radiant_win) FROM matches WHERE radiant_win IS NOT NULL AND radiant_win = 1 AND has_leaver = 0 AND radiant_hero_1 != 0 AND radiant_hero_2 != 0 AND radiant_hero_3 != 0 AND radiant_hero_4 != 0 AND radiant_hero_5 != 0 AND dire_hero_1 != 0 AND dire_hero_2 != 0 AND dire_hero_3 != 0 AND dire_hero_4 != 0 AND dire_hero_5 != 0').fetchone()[0]
-		number_of_dire_wins = connection.execute('SELECT COUNT(radiant_win) FROM matches WHERE radiant_win IS NOT NULL AND radiant_win = 0 AND has_leaver = 0 AND radiant_hero_1 != 0 AND radiant_hero_2 != 0 AND radiant_hero_3 != 0 AND radiant_hero_4 != 0 AND radiant_hero_5 != 0 AND dire_hero_1 != 0 AND dire_hero_2 != 0 AND dire_hero_3 != 0 AND dire_hero_4 != 0 AND dire_hero_5 != 0').fetchone()[0]
-		max_games_per_class = min(number_of_radiant_wins, number_of_dire_wins)
-		radiant_wins = 0
-		dire_wins = 0
-	dataset = list()
-	targetset = list()
-	for lineno, line in enumerate(connection.execute('SELECT radiant_win, radiant_hero_1,radiant_hero_2,radiant_hero_3,radiant_hero_4,radiant_hero_5, dire_hero_1,dire_hero_2,dire_hero_3,dire_hero_4,dire_hero_5 FROM matches WHERE radiant_win IS NOT NULL AND has_leaver = 0 AND radiant_hero_1 != 0 AND radiant_hero_2 != 0 AND radiant_hero_3 != 0 AND radiant_hero_4 != 0 AND radiant_hero_5 != 0 AND dire_hero_1 != 0 AND dire_hero_2 != 0 AND dire_hero_3 != 0 AND dire_hero_4 != 0 AND dire_hero_5 != 0')):
-		radiant_won = line[0]
-
-		if undersample:
-			if radiant_wins == max_games_per_class and dire_wins == max_games_per_class: #both classes already at max games
-				break
-			elif radiant_won == 0: #dire won
-				if dire_wins == max_games_per_class: #dire already at max games
-					continue
-				else:
-					dire_wins += 1
-			else: #radiant won
-				if radiant_wins == max_games_per_class: #radiant already at max games
-					continue
-				else:
-					radiant_wins += 1
-
-		radiant_hero_ids = line[1:6]
-		dire_hero_ids  = line[6:]
-
-		winner, features = extract_standard(radiant_won, radiant_hero_ids, dire_hero_ids)
-		targetset.append(winner)
-		dataset.append(features)
+	cursor = connection.execute('SELECT radiant_win, ' + hero_columns + ' FROM matches WHERE ' + usable_matches)
+	chunks = list()
+	while True:
+		rows = cursor.fetchmany(chunk_size)
+		if len(rows) == 0:
+			break
+		chunks.append(np.array(rows, dtype=np.int16))
 	connection.close()
+	matches = np.concatenate(chunks) if len(chunks) != 0 else np.zeros((0, 11), dtype=np.int16)
+	del chunks
+	
+	(samples, target) = make_dataset(matches[:, 0] != 0, simple_heroes.real_to_ordered_array(matches[:, 1:]), undersample, sparse)
+	if verbose:
+		print_load_statistics(len(target), time.time() - start)
+	return (samples, target)
+
+def load_store_data(path, undersample=True, sparse=False, verbose=False):
+	"""
+	Like load_data but read the matches from a binary match store (see match_store.py) instead of the sqlite3 database.
 	
-	samples = np.array(dataset)
-	target = np.array(targetset)
-	# http://stackoverflow.com/questions/4601373/better-way-to-shuffle-two-numpy-arrays-in-unison
-	rng_state = np.random.get_state()
-	np.random.shuffle(samples)
-	np.random.set_state(rng_state)
-	np.random.shuffle(target)
+	The store is memory mapped, only the selected columns of the usable matches are copied.
+	"""
+	start = time.time()
+	store = match_store.open_store(path)
+	usable = (store['flags'] & match_store.has_leaver_flag) == 0
+	radiant_won = (store['flags'][usable] & match_store.radiant_win_flag) != 0
+	(samples, target) = make_dataset(radiant_won, store['heroes'][usable], undersample, sparse)
+	if verbose:
+		print_load_statistics(len(target), time.time() - start)
 	return (samples, target)
 
-def extract_standard(radiant_won, radiant, dire):
+def make_dataset(radiant_won, heroes, undersample, sparse):
+	"""Undersample, featurize and shuffle matches given as an array of winners and an array of 10 ordered hero ids per match."""
+	if undersample:
+		# position of every match among the matches of its class
+		radiant_rank = np.cumsum(radiant_won)
+		dire_rank = np.cumsum(~radiant_won)
+		max_games_per_class = min(radiant_rank[-1], dire_rank[-1]) if len(radiant_won) != 0 else 0
+		keep = np.where(radiant_won, radiant_rank <= max_games_per_class, dire_rank <= max_games_per_class)
+		heroes = heroes[keep]
+		radiant_won = radiant_won[keep]
+	
+	samples = heroes_to_features(heroes, sparse=sparse)
+	target = (~radiant_won).astype(np.int64)
+	permutation = np.random.permutation(len(target))
+	return (samples[permutation], target[permutation])
+
+def print_load_statistics(rows, duration):
+	print("Loaded", rows, "matches in", round(duration, 2), "seconds ({:.0f} rows/s).".format(rows / duration if duration > 0 else 0))
+	if resource is not None:
+		# ru_maxrss is in kilobytes on Linux
+		print("Peak memory use of the process: {:.1f} MB".format(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+def heroes_to_features(heroes, sparse=False):
+	"""
+	Turn an array with one row of 5 radiant and 5 dire ordered hero ids per match into a feature matrix with the layout of extract_standard.
+	
+	With sparse a scipy.sparse CSR matrix is returned, otherwise a dense uint8 array.
+	"""
+	hero_count = len(simple_heroes.dota_hero_ids)
+	columns = np.empty(heroes.shape, dtype=np.int32)
+	columns[:, :5] = heroes[:, :5]
+	columns[:, 5:] = heroes[:, 5:] + hero_count
+	if sparse:
+		# sorted column indices within each row are the canonical CSR format
+		columns.sort(axis=1)
+		return scipy.sparse.csr_matrix((np.ones(columns.size, dtype=np.uint8), columns.ravel(), np.arange(0, columns.size + 1, 10)), shape=(len(heroes), 2 * hero_count))
+	features = np.zeros((len(heroes), 2 * hero_count), dtype=np.uint8)
+	features[np.arange(len(heroes))[:, np.newaxis], columns] = 1
+	return features
+
+def extract_standard(radiant_won, radiant, dire, out=None):
 	"""
 	Turn a match constisting of its winner and the radiant and dire heroes into a feature vector.
 	
 	The default version uses a 224 dimensional feature vector and sets elements corresponding to the picked heroes to 1 while the rest are set to 0.
 	The first 112 elements are the heroes on the radiant team and the other the heroes on the dire team.
 	
+	The feature vector is written into out if it is given, which has to be an all zero numpy array of the right length. Otherwise a new array is allocated.
+	
 	The target class 0 represents the radiant winning, and 1 the dire winning.
 	"""
-	def put_heroes_in_features(heroes, features):
-		for i in heroes:
-			features[simple_heroes.real_to_ordered(i)] = 1.0
-
 	winner = int(not radiant_won)
 
-	radiant_heroes = [0] * len(simple_heroes.dota_hero_ids)
-	dire_heroes = [0] * len(simple_heroes.dota_hero_ids)
-
-	put_heroes_in_features(radiant, radiant_heroes)
-	put_heroes_in_features(dire, dire_heroes)
-
-	features = radiant_heroes + dire_heroes
+	hero_count = len(simple_heroes.dota_hero_ids)
+	features = np.zeros(2 * hero_count) if out is None else out
+	features[[simple_heroes.real_to_ordered(i) for i in radiant]] = 1.0
+	features[[hero_count + simple_heroes.real_to_ordered(i) for i in dire]] = 1.0
 
 	return (winner, features)
 
@@ -127,6 +171,74 @@ def make_training_validate_test(database, training_ratio, undersample=True):
 	joblib.dump(test_data, "data/test_data");
 	joblib.dump(test_target, "data/test_target");
 
+# Splits of the streaming functions
+TRAINING = 0
+VALIDATE = 1
+TEST = 2
+
+def split_of(match_ids, training_ratio):
+	"""
+	Assign matches to the TRAINING, VALIDATE or TEST split based on a hash of their match id.
+	
+	The assignment only depends on the match id and the ratio, so it stays the same when the database grows and no split has to be stored. Like in make_training_validate_test the validate and test splits get half of the remaining matches each.
+	"""
+	# Fibonacci hashing spreads consecutive ids evenly, the top 53 bits become a fraction in [0, 1)
+	hashes = np.asarray(match_ids, dtype=np.uint64) * np.uint64(11400714819323198485)
+	fraction = (hashes >> np.uint64(11)).astype(np.float64) / 2**53
+	validate_ratio = (1 - training_ratio) / 2
+	return np.where(fraction < training_ratio, TRAINING, np.where(fraction < training_ratio + validate_ratio, VALIDATE, TEST))
+
+def stream_data(database, split, training_ratio, chunk_size=10000, undersample=True, sparse=True):
+	"""
+	Read the matches of one split from a sqlite3 database in chunks and yield (samples, target) for each chunk.
+	
+	Only one chunk is in memory at a time. Chunks are shuffled internally but come in database order. With undersample each chunk is cut down to the same number of samples of both classes.
+	"""
+	connection = sqlite3.connect(database)
+	cursor = connection.execute('SELECT match_id, radiant_win, ' + hero_columns + ' FROM matches WHERE ' + usable_matches)
+	try:
+		while True:
+			rows = cursor.fetchmany(chunk_size)
+			if len(rows) == 0:
+				break
+			matches = np.array(rows, dtype=np.int64)
+			matches = matches[split_of(matches[:, 0], training_ratio) == split]
+			radiant_won = matches[:, 1] != 0
+			if undersample:
+				max_games_per_class = min(np.count_nonzero(radiant_won), np.count_nonzero(~radiant_won))
+				keep = np.where(radiant_won, np.cumsum(radiant_won) <= max_games_per_class, np.cumsum(~radiant_won) <= max_games_per_class)
+				matches = matches[keep]
+				radiant_won = radiant_won[keep]
+			if len(matches) == 0:
+				continue
+			permutation = np.random.permutation(len(matches))
+			samples = heroes_to_features(simple_heroes.real_to_ordered_array(matches[permutation, 2:]), sparse=sparse)
+			target = (~radiant_won[permutation]).astype(np.int64)
+			yield (samples, target)
+	finally:
+		connection.close()
+
+def train_streaming(model, database, training_ratio, epochs=1, chunk_size=10000, undersample=True, sparse=True):
+	"""
+	Train a model that supports partial_fit (for example SGDClassifier or MLPClassifier) on the training split without loading the whole dataset.
+	
+	Memory use depends on chunk_size, not on the size of the database.
+	"""
+	classes = np.array([0, 1])
+	for epoch in range(epochs):
+		for (samples, target) in stream_data(database, TRAINING, training_ratio, chunk_size=chunk_size, undersample=undersample, sparse=sparse):
+			model.partial_fit(samples, target, classes=classes)
+	return model
+
+def score_streaming(model, database, split, training_ratio, chunk_size=10000, undersample=True, sparse=True):
+	"""Mean accuracy of a model on a split, computed chunk by chunk."""
+	correct = 0
+	total = 0
+	for (samples, target) in stream_data(database, split, training_ratio, chunk_size=chunk_size, undersample=undersample, sparse=sparse):
+		correct += np.count_nonzero(model.predict(samples) == target)
+		total += len(target)
+	return correct / total if total != 0 else 0.0
+
 def export_model(model, name):
 	"""Export a model to disk. Models can consist of multiple files so a directory is created for each model."""
 	path = "data/{}/".format(name)
@@ -159,7 +271,7 @@ def print_speed_and_accuracy(models = ["decisiontree", "gradienttreeboosting", "
 		accuracy = model.score(test_data, test_target)
 		start = time.time()
 		for i in range(1000):
-			model.predict_proba([test_data[i]])
+			model.predict_proba(test_data[i:i+1])
 		end = time.time()
 		duration = end - start
 		print(model, accuracy, duration)
@@ -190,6 +302,13 @@ if __name__ == '__main__':
 	model.fit(training_data, training_target)
 	model.score(validate_data, validate_target)
 
+	# Alternatively train a model that supports partial_fit while streaming the data from the database.
+	# This does not need the generated data sets and the memory use does not grow with the database.
+	# model = linear_model.SGDClassifier(loss='log') # loss='log_loss' in newer scikit-learn versions
+	# modelname = "sgdlogisticregression"
+	# train_streaming(model, "data/matches.sqlite", 0.8, epochs=5)
+	# print(score_streaming(model, "data/matches.sqlite", VALIDATE, 0.8))
+
 	# Export it to disk
 	export_model(model, modelname)
 	
\ No newline at end of file
@@ -0,0 +1,149 @@
+import argparse
+import sqlite3
+
+import numpy as np
+
+import simple_heroes
+
+"""
+A compact binary copy of the complete matches of a sqlite3 database, made to be opened with np.memmap.
+
+The file starts with a 16 byte header: 8 magic bytes and the seq of the last entry of the completed_matches log of the database that has been exported (see append_from_database).
+It is followed by one record of match_dtype per match, in the order they were appended.
+Only matches with details (radiant_win is not NULL) are exported.
+"""
+
+magic = b'DOTAMS1\0'
+header_size = 16
+match_dtype = np.dtype([
+	('match_id', '<u8'),
+	('start_time', '<u4'),
+	('duration', '<u2'),
+	('game_mode', 'u1'),
+	# radiant_win_flag | has_leaver_flag
+	('flags', 'u1'),
+	# ordered hero ids, the first 5 are radiant and the last 5 dire
+	('heroes', 'u1', (10,)),
+])
+radiant_win_flag = 1
+has_leaver_flag = 2
+
+columns = 'match_id, start_time, duration, game_mode, radiant_win, has_leaver, radiant_hero_1,radiant_hero_2,radiant_hero_3,radiant_hero_4,radiant_hero_5, dire_hero_1,dire_hero_2,dire_hero_3,dire_hero_4,dire_hero_5'
+
+def read_header(path):
+	try:
+		with open(path, 'rb') as f:
+			header = f.read(header_size)
+	except FileNotFoundError:
+		return None
+	if len(header) == 0:
+		return None
+	if len(header) != header_size or header[:8] != magic:
+		raise RuntimeError("{} is not a match store.".format(path))
+	return int(np.frombuffer(header, dtype='<u8', count=1, offset=8)[0])
+
+def open_store(path, mode='r'):
+	"""Memory map the matches of a store as a structured array of match_dtype. Returns an empty array for a store without matches."""
+	with open(path, 'rb') as f:
+		f.seek(0, 2)
+		size = f.tell()
+	count = (size - header_size) // match_dtype.itemsize
+	if count <= 0:
+		return np.zeros(0, dtype=match_dtype)
+	return np.memmap(path, dtype=match_dtype, mode=mode, offset=header_size, shape=(count,))
+
+def rows_to_records(rows):
+	"""Convert rows with the columns of this module's query to records, dropping rows with heroes that simple_heroes does not know."""
+	if len(rows) == 0:
+		return np.zeros(0, dtype=match_dtype)
+	values = np.array(rows, dtype=np.int64)
+	real_heroes = values[:, 6:]
+	known = (real_heroes > 0) & (real_heroes < len(simple_heroes.real_to_ordered_numpy))
+	known[known] = simple_heroes.real_to_ordered_numpy[real_heroes[known]] != -1
+	values = values[known.all(axis=1)]
+	records = np.zeros(len(values), dtype=match_dtype)
+	records['match_id'] = values[:, 0]
+	records['start_time'] = values[:, 1]
+	records['duration'] = values[:, 2]
+	records['game_mode'] = values[:, 3]
+	records['flags'] = np.where(values[:, 4] != 0, radiant_win_flag, 0) | np.where(values[:, 5] != 0, has_leaver_flag, 0)
+	records['heroes'] = simple_heroes.real_to_ordered_array(values[:, 6:])
+	return records
+
+def append_from_database(database, path, chunk_size=100000):
+	"""
+	Append the complete matches of the database that are not in the store yet, creating the store if needed. Returns the number of appended matches.
+
+	Details of a match can arrive long after it was added and the MatchHistory crawler adds older matches after newer ones, so neither match ids nor insertion order tell which matches are new.
+	Instead the completed_matches log of the database (see get_data.create_match_log) lists the matches in the order they became complete and the header remembers how far it has been read.
+	Databases without the log are read completely every time. Matches that are already stored are never appended again.
+	"""
+	last_seq = read_header(path)
+	if last_seq is None:
+		with open(path, 'wb') as f:
+			f.write(magic + np.zeros(1, dtype='<u8').tobytes())
+		last_seq = 0
+	stored = open_store(path)
+	stored_ids = np.sort(stored['match_id'])
+	del stored
+	connection = sqlite3.connect(database, timeout=10)
+	if has_match_log(connection):
+		# read before the matches, so that matches which become complete while we read are picked up next time
+		(newest_seq,) = connection.execute("SELECT MAX(seq) FROM completed_matches").fetchone()
+		newest_seq = newest_seq or 0
+		cursor = connection.execute("SELECT " + columns + " FROM matches WHERE match_id IN (SELECT match_id FROM completed_matches WHERE seq > ? AND seq <= ?)", (last_seq, newest_seq))
+	else:
+		newest_seq = last_seq
+		cursor = connection.execute("SELECT " + columns + " FROM matches WHERE radiant_win IS NOT NULL")
+	appended = 0
+	with open(path, 'r+b') as f:
+		f.seek(0, 2)
+		while True:
+			rows = cursor.fetchmany(chunk_size)
+			if len(rows) == 0:
+				break
+			records = rows_to_records(rows)
+			position = np.searchsorted(stored_ids, records['match_id'])
+			new = position == len(stored_ids)
+			new[~new] = stored_ids[position[~new]] != records['match_id'][~new]
+			f.write(records[new].tobytes())
+			appended += np.count_nonzero(new)
+		f.seek(0)
+		f.write(magic + np.array([newest_seq], dtype='<u8').tobytes())
+	connection.close()
+	return appended
+
+def has_match_log(connection):
+	return connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'completed_matches'").fetchone() is not None
+
+def verify(database, path):
+	"""
+	Check the store against its database.
+	
+	Returns the ids of matches that are stored more than once, that differ from the database, that are in the store but not complete in the database, or that are complete in the database but missing from the store.
+	"""
+	stored = np.sort(np.array(open_store(path)), order='match_id')
+	connection = sqlite3.connect(database, timeout=10)
+	expected = rows_to_records(connection.execute("SELECT " + columns + " FROM matches WHERE radiant_win IS NOT NULL ORDER BY match_id").fetchall())
+	connection.close()
+	duplicates = stored['match_id'][1:][stored['match_id'][1:] == stored['match_id'][:-1]]
+	stored = stored[np.concatenate(([True], stored['match_id'][1:] != stored['match_id'][:-1]))] if len(stored) != 0 else stored
+	in_database = np.isin(stored['match_id'], expected['match_id'])
+	in_store = np.isin(expected['match_id'], stored['match_id'])
+	different = np.zeros(np.count_nonzero(in_database), dtype=bool)
+	for name in match_dtype.names:
+		difference = stored[name][in_database] != expected[name][in_store]
+		different |= difference.reshape(len(different), -1).any(axis=1)
+	inconsistent = np.concatenate((duplicates, stored['match_id'][in_database][different], stored['match_id'][~in_database], expected['match_id'][~in_store]))
+	return np.unique(inconsistent).tolist()
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Export the complete matches of a database to a binary match store, or append the new ones to an existing store.")
+	parser.add_argument("--database", required=True)
+	parser.add_argument("--store", required=True)
+	parser.add_argument("--verify", action="store_true", help="Check the store against the database after exporting.")
+	args = parser.parse_args()
+	print("Appended", append_from_database(args.database, args.store), "matches.")
+	if args.verify:
+		different = verify(args.database, args.store)
+		print("Store matches the database." if len(different) == 0 else "{} matches differ from the database, for example {}.".format(len(different), different[:10]))
\ No newline at end of file
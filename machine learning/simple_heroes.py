@@ -1,6 +1,12 @@
 import json
 from difflib import SequenceMatcher
 
+# numpy is only needed for the vectorized conversions, get_data.py works without it
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
 """
 The purpose of this module is to provde some utility functions related to hero ids.
 
@@ -9,6 +15,8 @@ It can convert the real hero ids as used in Dota2 into "minimial" or "ordered" i
 It can retrieve the name of a hero given its real or ordered id.
 
 I can find the hero id of a hero given its approximate name.
+
+Conversions use lookup tables built when the module is loaded. With numpy, whole arrays of ids can be converted at once with real_to_ordered_array and ordered_to_real_array.
 """
 
 # A list of all hero ids in ascending order. Ordered hero ids are defined by their index in this list.
@@ -16,11 +24,36 @@ dota_hero_ids = list()
 # Maps real hero ids to their names
 dota_hero_names = dict()
 
+# Dense lookup tables, filled in at the end of this file.
+# real_to_ordered_table[real id] is the ordered id, or -1 if there is no hero with that id.
+real_to_ordered_table = list()
+ordered_to_real_table = list()
+# The same tables as numpy arrays, None if numpy is not available.
+real_to_ordered_numpy = None
+ordered_to_real_numpy = None
+
 def real_to_ordered(id):
-	return dota_hero_ids.index(id)
+	ordered = real_to_ordered_table[id] if 0 <= id < len(real_to_ordered_table) else -1
+	if ordered == -1:
+		raise ValueError("{} is not a hero id".format(id))
+	return ordered
 	
 def ordered_to_real(id):
-	return dota_hero_ids[id]
+	return ordered_to_real_table[id]
+
+def real_to_ordered_array(ids):
+	"""Convert a numpy array (of any shape) of real hero ids to ordered ids."""
+	ids = np.asarray(ids)
+	if ids.size != 0 and (ids.min() < 0 or ids.max() >= len(real_to_ordered_numpy)):
+		raise ValueError("Array contains ids that are not hero ids")
+	ordered = real_to_ordered_numpy[ids]
+	if (ordered == -1).any():
+		raise ValueError("Array contains ids that are not hero ids")
+	return ordered
+
+def ordered_to_real_array(ids):
+	"""Convert a numpy array (of any shape) of ordered hero ids to real ids."""
+	return ordered_to_real_numpy[np.asarray(ids)]
 	
 def ordered_to_name(id):
 	return real_to_name(ordered_to_real(id))
@@ -49,4 +82,12 @@ heroes_raw = {'heroes': [{'name': 'npc_dota_hero_antimage', 'id': 1, 'localized_
 heroes = heroes_raw['heroes']
 for i in sorted(heroes, key=lambda h: h['id']):
 	dota_hero_ids.append(i['id'])
-	dota_hero_names[i['id']] = i['name'][len('npc_dota_hero')+1:]
\ No newline at end of file
+	dota_hero_names[i['id']] = i['name'][len('npc_dota_hero')+1:]
+
+real_to_ordered_table = [-1] * (max(dota_hero_ids) + 1)
+for ordered, real in enumerate(dota_hero_ids):
+	real_to_ordered_table[real] = ordered
+ordered_to_real_table = list(dota_hero_ids)
+if np is not None:
+	real_to_ordered_numpy = np.array(real_to_ordered_table, dtype=np.int16)
+	ordered_to_real_numpy = np.array(ordered_to_real_table, dtype=np.int16)
\ No newline at end of file
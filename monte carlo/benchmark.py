@@ -0,0 +1,337 @@
+import argparse
+import collections
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+
+import evaluators
+import mcts
+import mcts_arrays
+import mcts_transpositions
+import rollout
+import util
+import winrates
+from gamestate import State
+
+"""
+Benchmarks of the Monte Carlo tree search that do not need a trained model.
+
+Run from the repository root like main.py:
+python "monte carlo/benchmark.py"
+
+With --suite both searches are run with fixed seeds and iteration limits on positions of AP and CM drafts at several depths, using synthetic_model.
+The results can be written to a JSON file and compared against an earlier one to catch regressions:
+python "monte carlo/benchmark.py" --suite --json baseline.json
+python "monte carlo/benchmark.py" --suite --compare baseline.json
+"""
+
+def count_nodes(node):
+	return 1 + sum(count_nodes(child) for child in node.children)
+
+def grow_tree(order, expansions, seed):
+	util.pick_ban_order = order
+	random.seed(seed)
+	root_node = mcts.Node(State())
+	for _ in range(expansions):
+		node = mcts.tree_policy(root_node, util.allpick_cp)
+		# a random reward instead of a rollout keeps the model out of the measurement
+		mcts.backup(node, random.random())
+	return root_node
+
+def expansion_benchmark(order, expansions, seed=0):
+	"""Grow an mcts tree with the given number of expansions and return (expansions per second, tree memory in bytes, node count)."""
+	start_time = time.perf_counter()
+	grow_tree(order, expansions, seed)
+	duration = time.perf_counter() - start_time
+	tracemalloc.start()
+	root_node = grow_tree(order, expansions, seed)
+	memory = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+	return (expansions / duration, memory, count_nodes(root_node))
+
+def synthetic_model(seed=0, spread=0.3):
+	"""A logistic regression in which every hero has a random strength, the same on both sides. Compiled to an evaluators.LinearEvaluator."""
+	strength = np.random.RandomState(seed).normal(0, spread, util.hero_count)
+	model = LogisticRegression()
+	# class 1 is a dire win
+	model.coef_ = np.concatenate((-strength, strength)).reshape(1, -1)
+	model.intercept_ = np.zeros(1)
+	model.classes_ = np.array([0, 1])
+	return evaluators.compile_model(model, util.hero_count)
+
+def synthetic_winrates(model, matches=100000, seed=0):
+	"""winrates.Winrates of random drafts whose winners are drawn with the probabilities the model predicts."""
+	random_state = np.random.RandomState(seed)
+	heroes = np.argsort(random_state.random_sample((matches, util.hero_count)), axis=1)[:, :10]
+	features = np.zeros((matches, 2 * util.hero_count))
+	rows = np.arange(matches)[:, np.newaxis]
+	features[rows, heroes[:, :5]] = 1
+	features[rows, util.hero_count + heroes[:, 5:]] = 1
+	radiant_won = random_state.random_sample(matches) < model.predict_proba(features)[:, 0]
+	statistics = winrates.Winrates(util.hero_count)
+	statistics.add_matches(radiant_won, heroes)
+	return statistics
+
+def stability_benchmark(model, order, policy, time_limit, runs, seed=0):
+	"""
+	Search the first move of a draft runs times with the given rollout policy and time limit.
+	
+	Returns the share of runs that recommend the most frequent action, the number of different recommendations and the mean number of iterations.
+	"""
+	util.pick_ban_order = order
+	util.rollout_policy = policy
+	recommendations = collections.Counter()
+	iterations = 0
+	for run in range(runs):
+		random.seed(seed + run)
+		(best, root_node, _) = mcts_transpositions.uct_search(model, initial_state=State(), transpositions=dict(), time_limit=time_limit)
+		recommendations[best.incoming_action] += 1
+		iterations += root_node.visit_count
+	util.rollout_policy = None
+	return (recommendations.most_common(1)[0][1] / runs, len(recommendations), iterations / runs)
+
+def draft_position(order, depth, seed=0):
+	"""The state after depth random actions of the draft, the same for the same seed."""
+	util.pick_ban_order = order
+	random.seed(seed)
+	state = State()
+	for _ in range(depth):
+		state = state.get_next_state(state.choose_random_action())
+	return state
+
+searches = {
+	"mcts": lambda model, state, iterations, Cp: mcts.uct_search(model, initial_state=state, iteration_limit=iterations, Cp=Cp)[1],
+	"transpositions": lambda model, state, iterations, Cp: mcts_transpositions.uct_search(model, initial_state=state, iteration_limit=iterations, Cp=Cp)[1],
+	"arrays": lambda model, state, iterations, Cp: mcts_arrays.uct_search(model, initial_state=state, iteration_limit=iterations, Cp=Cp)[1],
+}
+
+# The phases of an iteration and the functions the searches call for them. The module attributes are replaced while timing, see phase_times.
+phases = (
+	("tree_policy", ((mcts, "tree_policy"), (mcts_transpositions, "tree_policy"), (mcts_arrays, "tree_policy"))),
+	("rollout", ((mcts, "random_playout"), (mcts, "random_playouts"), (mcts_transpositions, "random_playout"), (mcts_transpositions, "random_playouts"), (mcts_arrays, "random_playout"), (mcts_arrays, "random_playouts"))),
+	("evaluation", ((mcts, "compute_reward"), (mcts, "compute_rewards"), (mcts, "compute_mean_rewards"), (mcts_transpositions, "compute_rewards"), (mcts_transpositions, "compute_mean_rewards"), (mcts_arrays, "compute_rewards"), (mcts_arrays, "compute_mean_rewards"))),
+	("backup", ((mcts, "backup"), (mcts_transpositions, "backup"), (mcts_arrays, "backup"))),
+)
+
+def phase_times(run):
+	"""Call run with the functions of every phase wrapped by timers. Returns the seconds spent in each phase and in total."""
+	times = dict.fromkeys([name for (name, _) in phases], 0.0)
+	originals = list()
+	def timed(name, function):
+		def wrapper(*args, **kwargs):
+			start = time.perf_counter()
+			try:
+				return function(*args, **kwargs)
+			finally:
+				times[name] += time.perf_counter() - start
+		return wrapper
+	for (name, functions) in phases:
+		for (module, attribute) in functions:
+			originals.append((module, attribute, getattr(module, attribute)))
+			setattr(module, attribute, timed(name, getattr(module, attribute)))
+	start = time.perf_counter()
+	try:
+		run()
+	finally:
+		for (module, attribute, function) in originals:
+			setattr(module, attribute, function)
+	return (times, time.perf_counter() - start)
+
+def search_benchmark(model, search, mode, depth, iterations, seed=0, repeats=3):
+	"""
+	Run one search of the suite several times with the same seed, which grows the same tree each time.
+	
+	The speed is that of the fastest of repeats runs. One more run measures the share of time of each phase and another the peak memory and the size of the tree.
+	"""
+	(order, Cp) = (util.allpick_order, util.allpick_cp) if mode == "ap" else (util.cm_order, util.cm_cp)
+	state = draft_position(order, depth, seed)
+	def run():
+		random.seed(seed)
+		return searches[search](model, state, iterations, Cp)
+	duration = float("inf")
+	for _ in range(repeats):
+		start = time.perf_counter()
+		run()
+		duration = min(duration, time.perf_counter() - start)
+	(times, timed_duration) = phase_times(run)
+	tracemalloc.start()
+	root_node = run()
+	peak_memory = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	times["other"] = timed_duration - sum(times.values())
+	return {
+		"search": search,
+		"mode": mode,
+		"depth": depth,
+		"iterations": iterations,
+		"seed": seed,
+		"seconds": duration,
+		"iterations_per_second": iterations / duration,
+		"time_shares": {name: t / timed_duration for name, t in times.items()},
+		"peak_memory": peak_memory,
+		"nodes": count_nodes(root_node),
+	}
+
+suite_depths = {"ap": (0, 4, 8), "cm": (0, 8, 16)}
+
+# (util.move_groups, widening) of the searches compared by convergence_benchmark
+expansion_modes = {
+	"flat": (False, None),
+	"flat widening": (False, (1.0, 0.5)),
+	"move groups": (True, None),
+	"move groups widening": (True, (1.0, 0.5)),
+}
+
+def action_value(model, state, action, rollouts):
+	"""Mean reward of the team that makes the action over rollouts random drafts after it."""
+	next_state = state.get_next_state(action)
+	return sum(mcts.default_policy(next_state, model) for _ in range(rollouts)) / rollouts
+
+def rollout_benchmark(model, order, depth, rollouts=4096, batch_size=256, seed=0):
+	"""
+	Play rollouts random drafts from the position after depth random actions of the draft, and evaluate them with the model.
+	
+	Returns the rollouts per second when they are played and evaluated one at a time, when batch_size drafts played by mcts.random_playout are evaluated with one call,
+	and when batch_size drafts are played at once by rollout.random_drafts.
+	"""
+	state = draft_position(order, depth, seed)
+	for_radiant = state.radiant_moved()
+	def single():
+		for _ in range(rollouts):
+			mcts.default_policy(state, model)
+	def batched():
+		for _ in range(rollouts // batch_size):
+			mcts.compute_rewards([mcts.random_playout(state) for _ in range(batch_size)], [for_radiant] * batch_size, model)
+	def vectorized():
+		for _ in range(rollouts // batch_size):
+			mcts.default_policy(state, model, batch_size)
+	played = rollouts // batch_size * batch_size
+	speeds = dict()
+	for name, run, count in (("single", single, rollouts), ("batched", batched, played), ("vectorized", vectorized, played)):
+		random.seed(seed)
+		start = time.perf_counter()
+		run()
+		speeds[name] = count / (time.perf_counter() - start)
+	return speeds
+
+def convergence_benchmark(model, order, depth, budgets, runs, seed=0, rollouts=1000):
+	"""
+	Search the position after depth random actions of the draft with every mode of expansion_modes and iteration budget, runs times each with different seeds.
+	
+	Returns {mode: [(budget, mean value of the recommended actions, share of runs that recommend the most frequent action)]}. The values are estimated with action_value.
+	"""
+	state = draft_position(order, depth, seed)
+	Cp = util.allpick_cp if order == util.allpick_order else util.cm_cp
+	values = dict()
+	results = dict()
+	previous_move_groups = util.move_groups
+	try:
+		for mode, (move_groups, widening) in expansion_modes.items():
+			util.move_groups = move_groups
+			results[mode] = list()
+			for budget in budgets:
+				recommendations = collections.Counter()
+				for run in range(runs):
+					random.seed(seed + run)
+					(best, _, transpositions) = mcts_transpositions.uct_search(model, initial_state=state, transpositions=dict(), iteration_limit=budget, Cp=Cp, widening=widening)
+					recommendations[mcts_transpositions.full_action(best, transpositions)] += 1
+				for action in recommendations:
+					if action not in values:
+						random.seed(seed)
+						values[action] = action_value(model, state, action, rollouts)
+				mean_value = sum(values[action] * n for action, n in recommendations.items()) / runs
+				results[mode].append((budget, mean_value, recommendations.most_common(1)[0][1] / runs))
+	finally:
+		util.move_groups = previous_move_groups
+	return results
+
+def benchmark_suite(iterations=2000, seed=0, repeats=3, verbose=True):
+	model = synthetic_model(seed)
+	results = list()
+	for mode, depths in suite_depths.items():
+		for depth in depths:
+			for search in searches:
+				result = search_benchmark(model, search, mode, depth, iterations, seed, repeats)
+				results.append(result)
+				if verbose: print_result(result)
+	return {
+		"python": platform.python_version(),
+		"numpy": np.__version__,
+		"platform": platform.platform(),
+		"results": results,
+	}
+
+def print_result(result):
+	shares = ", ".join("{} {:.0%}".format(name, share) for name, share in result["time_shares"].items())
+	print("{search} {mode} depth {depth}: {iterations_per_second:.0f} iterations/s, {nodes} nodes, {memory:.1f} MB peak ({shares})".format(memory=result["peak_memory"] / 2**20, shares=shares, **result))
+
+def compare(results, baseline, tolerance):
+	"""Return the results whose speed is more than tolerance below that of the same search in the baseline, with the baseline speed."""
+	key = lambda r: (r["search"], r["mode"], r["depth"], r["iterations"], r["seed"])
+	previous = {key(r): r for r in baseline["results"]}
+	slower = list()
+	for result in results["results"]:
+		old = previous.get(key(result))
+		if old is not None and result["iterations_per_second"] < (1 - tolerance) * old["iterations_per_second"]:
+			slower.append((result, old["iterations_per_second"]))
+	return slower
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--expansions", type=int, default=20000)
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--rollouts", action="store_true", help="Compare the recommendations of uniform and informed rollouts instead.")
+	parser.add_argument("--time-limit", type=float, default=1.0, help="Time limit of every search of --rollouts.")
+	parser.add_argument("--runs", type=int, default=10, help="Number of searches per policy of --rollouts.")
+	parser.add_argument("--suite", action="store_true", help="Run the search benchmark suite instead.")
+	parser.add_argument("--iterations", type=int, default=2000, help="Iteration limit of every search of --suite.")
+	parser.add_argument("--repeats", type=int, default=3, help="Number of timed runs of every search of --suite, the fastest one counts.")
+	parser.add_argument("--json", help="Write the results of --suite to this file.")
+	parser.add_argument("--compare", help="Compare the results of --suite with those in this file and exit with status 1 if a search got slower.")
+	parser.add_argument("--tolerance", type=float, default=0.3, help="Share by which a search of --compare may be slower.")
+	parser.add_argument("--convergence", action="store_true", help="Compare flat expansion, move groups and progressive widening on the double pick of captains mode instead.")
+	parser.add_argument("--rollout-speed", action="store_true", help="Compare the rollouts per second of single, batched and vectorized rollouts instead.")
+	parser.add_argument("--budgets", type=int, nargs="+", default=[1000, 3000, 10000], help="Iteration limits of --convergence.")
+	args = parser.parse_args()
+	if args.suite:
+		results = benchmark_suite(args.iterations, args.seed, args.repeats)
+		if args.json:
+			with open(args.json, "w") as f:
+				json.dump(results, f, indent=1)
+		if args.compare:
+			with open(args.compare) as f:
+				slower = compare(results, json.load(f), args.tolerance)
+			for (result, old_speed) in slower:
+				print("Slower: {search} {mode} depth {depth} {iterations_per_second:.0f} iterations/s, was {old:.0f}".format(old=old_speed, **result))
+			if len(slower) != 0: sys.exit(1)
+	elif args.rollout_speed:
+		model = synthetic_model(args.seed)
+		for mode, depths in suite_depths.items():
+			order = util.allpick_order if mode == "ap" else util.cm_order
+			for depth in depths:
+				speeds = rollout_benchmark(model, order, depth, seed=args.seed)
+				print("{} depth {}: ".format(mode, depth) + ", ".join("{} {:.0f} rollouts/s".format(name, speed) for name, speed in speeds.items()))
+	elif args.convergence:
+		# the first position whose action is a pick of two heroes
+		depth = [count for (_, count) in util.cm_order].index(2)
+		results = convergence_benchmark(synthetic_model(args.seed), util.cm_order, depth, args.budgets, args.runs, args.seed)
+		for mode, rows in results.items():
+			for (budget, value, agreement) in rows:
+				print("{} {} iterations: value {:.4f}, {:.0%} of runs agree".format(mode, budget, value, agreement))
+	elif args.rollouts:
+		model = synthetic_model(args.seed)
+		informed = rollout.InformedPolicy(synthetic_winrates(model, seed=args.seed))
+		for name, order in (("allpick", util.allpick_order), ("cm", util.cm_order)):
+			for policy_name, policy in (("uniform", None), ("informed", informed)):
+				(agreement, different, iterations) = stability_benchmark(model, order, policy, args.time_limit, args.runs, args.seed)
+				print("{} {}: {:.0%} of runs agree, {} different recommendations, {:.0f} iterations per search".format(name, policy_name, agreement, different, iterations))
+	else:
+		for name, order in (("allpick", util.allpick_order), ("cm", util.cm_order)):
+			(speed, memory, nodes) = expansion_benchmark(order, args.expansions, args.seed)
+			print("{}: {:.0f} expansions/s, {:.1f} MB tree memory, {} nodes".format(name, speed, memory / 2**20, nodes))
\ No newline at end of file
@@ -0,0 +1,135 @@
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import util
+
+"""
+Evaluators stand in for a scikit-learn model during the Monte Carlo tree search.
+
+Besides predict_proba they offer radiant_win_probability(state) and radiant_win_probabilities(states), which util.predict_state_radiant_win_probability uses to skip building feature vectors.
+"""
+
+# Replaces a linear model whose prediction is sigmoid(scale * (weights . feature + intercept)).
+# Features are 0/1 hero indicators, so the dot product is the sum of the weights of the at most 10 picked heroes.
+# The scale is 2 for binary models trained as multinomial, which apply a softmax to (-decision, decision).
+class LinearEvaluator:
+	def __init__(self, model, hero_count, scale=1):
+		coef = scale * np.asarray(model.coef_, dtype=np.float64).ravel()
+		assert(len(coef) == 2 * hero_count)
+		self.model = model
+		self.classes_ = model.classes_
+		self.coef = coef
+		self.radiant_weights = coef[:hero_count]
+		self.dire_weights = coef[hero_count:]
+		self.intercept = scale * float(np.ravel(model.intercept_)[0])
+		# the decision function is the log odds of classes_[1], radiant winning is class 0
+		self.radiant_win_is_positive = model.classes_[1] == 0
+		# a plain list is faster than a numpy array for summing a handful of scalars
+		self.coef_list = coef.tolist()
+	def __repr__(self):
+		return 'LinearEvaluator({!r})'.format(self.model)
+	def decision_function(self, features):
+		return np.asarray(features, dtype=np.float64) @ self.coef + self.intercept
+	def predict_proba(self, features):
+		positive = 1 / (1 + np.exp(-self.decision_function(features)))
+		return np.column_stack((1 - positive, positive))
+	def radiant_win_probability(self, state):
+		z = self.intercept
+		for i in state.feature_indices: z += self.coef_list[i]
+		if self.radiant_win_is_positive: z = -z
+		return 1 / (1 + math.exp(z))
+	def radiant_win_probabilities(self, states):
+		# sum the weights of every picked hero into the row of its state
+		rows = np.repeat(np.arange(len(states)), [len(state.feature_indices) for state in states])
+		columns = np.fromiter((i for state in states for i in state.feature_indices), dtype=np.intp, count=len(rows))
+		z = np.bincount(rows, weights=self.coef[columns], minlength=len(states)) + self.intercept
+		if self.radiant_win_is_positive: z = -z
+		return (1 / (1 + np.exp(z))).tolist()
+
+# Remembers the predictions of the wrapped model for terminal drafts, keyed on the radiant and dire heroes.
+# Holds at most max_size drafts and evicts the least recently used one when full.
+# The cache and the counters are guarded by a lock so that the threads of parallel.tree_parallel_search can share the evaluator.
+class CachedEvaluator:
+	def __init__(self, model, max_size=100000):
+		self.model = model
+		self.max_size = max_size
+		self.cache = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.lock = threading.Lock()
+	def __repr__(self):
+		return 'CachedEvaluator({!r})'.format(self.model)
+	# locks can not be pickled, the evaluator gets a new one in the worker processes of parallel.create_pool
+	def __getstate__(self):
+		state = dict(self.__dict__)
+		del state['lock']
+		return state
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.lock = threading.Lock()
+	def predict_proba(self, features):
+		return self.model.predict_proba(features)
+	def lookup(self, key):
+		with self.lock:
+			radiant_win = self.cache.get(key)
+			if radiant_win is None:
+				self.misses += 1
+			else:
+				self.hits += 1
+				self.cache.move_to_end(key)
+			return radiant_win
+	def store(self, key, radiant_win):
+		with self.lock:
+			self.cache[key] = radiant_win
+			if len(self.cache) > self.max_size:
+				self.cache.popitem(last=False)
+	def radiant_win_probability(self, state):
+		key = (state.radiant_mask, state.dire_mask)
+		radiant_win = self.lookup(key)
+		if radiant_win is None:
+			radiant_win = util.predict_state_radiant_win_probability(state, self.model)
+			self.store(key, radiant_win)
+		return radiant_win
+	def radiant_win_probabilities(self, states):
+		keys = [(state.radiant_mask, state.dire_mask) for state in states]
+		radiant_wins = [self.lookup(key) for key in keys]
+		missing = [i for i, radiant_win in enumerate(radiant_wins) if radiant_win is None]
+		if len(missing) != 0:
+			predictions = util.predict_state_radiant_win_probabilities([states[i] for i in missing], self.model)
+			for i, radiant_win in zip(missing, predictions):
+				radiant_wins[i] = radiant_win
+				self.store(keys[i], radiant_win)
+		return radiant_wins
+	def hit_rate(self):
+		lookups = self.hits + self.misses
+		return self.hits / lookups if lookups != 0 else 0.0
+
+def is_linear(model):
+	# imported here so that importing this module does not import scikit-learn
+	from sklearn.linear_model import LogisticRegression, SGDClassifier
+	if isinstance(model, LogisticRegression):
+		return len(model.classes_) == 2
+	if isinstance(model, SGDClassifier):
+		return model.loss in ("log", "log_loss") and len(model.classes_) == 2
+	return False
+
+# Returns a faster evaluator for the model if there is one for its type, otherwise the model itself.
+# The evaluator is only used if it reproduces predict_proba on some random drafts, which also tells which scale the model uses.
+def compile_model(model, hero_count, tolerance=1e-9):
+	if not is_linear(model) or np.asarray(model.coef_).size != 2 * hero_count:
+		return model
+	probe = np.zeros((20, 2 * hero_count))
+	random = np.random.RandomState(0)
+	for row in probe:
+		heroes = random.choice(hero_count, 10, replace=False)
+		row[heroes[:5]] = 1
+		row[hero_count + heroes[5:]] = 1
+	expected = model.predict_proba(probe)
+	for scale in (1, 2):
+		evaluator = LinearEvaluator(model, hero_count, scale)
+		if np.abs(evaluator.predict_proba(probe) - expected).max() <= tolerance:
+			return evaluator
+	return model
\ No newline at end of file
@@ -1,41 +1,153 @@
 import itertools
+import math
 import random
 import util
 
+# Sets of heroes are stored as integer bitmasks: ordered hero id i is in the set if bit i is set.
+def heroes_to_mask(heroes):
+	mask = 0
+	for i in heroes: mask |= 1 << i
+	return mask
+
+def mask_to_heroes(mask):
+	heroes = list()
+	while mask:
+		lowest = mask & -mask
+		heroes.append(lowest.bit_length() - 1)
+		mask ^= lowest
+	return heroes
+
+def count_heroes(mask):
+	return bin(mask).count('1')
+
+# The hero pool as a tuple and a mask. util.all_heroes can be replaced (see util.make_random_pool) so this is cached by identity.
+_pool_source = None
+_pool = ()
+_pool_mask = 0
+def hero_pool():
+	global _pool_source, _pool, _pool_mask
+	if util.all_heroes is not _pool_source:
+		_pool = tuple(sorted(util.all_heroes))
+		_pool_mask = heroes_to_mask(_pool)
+		_pool_source = util.all_heroes
+	return (_pool, _pool_mask)
+
+# Random 64 bit numbers for every hero as a radiant pick, a dire pick and a ban. The xor of the numbers of all picks and bans of a state is its Zobrist hash.
+# They come from their own generator so that they are the same in every process and do not depend on the seed of the search.
+_zobrist_random = random.Random(0)
+zobrist_radiant = [_zobrist_random.getrandbits(64) for _ in range(util.hero_count)]
+zobrist_dire = [_zobrist_random.getrandbits(64) for _ in range(util.hero_count)]
+zobrist_banned = [_zobrist_random.getrandbits(64) for _ in range(util.hero_count)]
+# for the heroes already chosen in a SubDecision
+zobrist_chosen = [_zobrist_random.getrandbits(64) for _ in range(util.hero_count)]
+
+def zobrist_hash(radiant_heroes, dire_heroes, banned_heroes):
+	result = 0
+	for i in radiant_heroes: result ^= zobrist_radiant[i]
+	for i in dire_heroes: result ^= zobrist_dire[i]
+	for i in banned_heroes: result ^= zobrist_banned[i]
+	return result
+
 class State:
+	__slots__ = ('radiant_mask', 'dire_mask', 'banned_mask', 'radiant_count', 'dire_count', 'radiant_moves_next', 'pick_ban_position', 'actions', 'feature_indices', 'zobrist')
 	def __init__(self, radiant_moves_next=True, radiant_heroes=frozenset(), dire_heroes=frozenset(), banned_heroes=frozenset(), pick_ban_position=0):
-		self.radiant_heroes = radiant_heroes
-		self.dire_heroes = dire_heroes
-		self.banned_heroes = banned_heroes
+		self.radiant_mask = heroes_to_mask(radiant_heroes)
+		self.dire_mask = heroes_to_mask(dire_heroes)
+		self.banned_mask = heroes_to_mask(banned_heroes)
+		self.radiant_count = count_heroes(self.radiant_mask)
+		self.dire_count = count_heroes(self.dire_mask)
 		self.radiant_moves_next = radiant_moves_next
 		self.pick_ban_position = pick_ban_position
 		self.actions = None
+		# indices of the 1.0 entries of the state's feature vector, see util.state_to_feature
+		self.feature_indices = tuple(mask_to_heroes(self.radiant_mask)) + tuple(util.hero_count + i for i in mask_to_heroes(self.dire_mask))
+		self.zobrist = zobrist_hash(radiant_heroes, dire_heroes, banned_heroes)
+	@property
+	def radiant_heroes(self):
+		return frozenset(mask_to_heroes(self.radiant_mask))
+	@property
+	def dire_heroes(self):
+		return frozenset(mask_to_heroes(self.dire_mask))
+	@property
+	def banned_heroes(self):
+		return frozenset(mask_to_heroes(self.banned_mask))
+	# hashable identity of the position, independent of the order the heroes were picked in
+	# zobrist is a 64 bit hash of the same, see zobrist_hash
+	def key(self):
+		return (self.radiant_mask, self.dire_mask, self.banned_mask)
+	def unavailable_mask(self):
+		return self.radiant_mask | self.dire_mask | self.banned_mask
+	def available_heroes(self):
+		(_, pool_mask) = hero_pool()
+		return mask_to_heroes(pool_mask & ~self.unavailable_mask())
 	def is_terminal(self):
-		return len(self.radiant_heroes) == util.team_size and len(self.dire_heroes) == util.team_size
-	# an action is just a tuple of hero ids
+		return self.radiant_count == util.team_size and self.dire_count == util.team_size
+	# an action is just a tuple of hero ids in ascending order
 	# return a list of those actions
 	def get_actions(self):
 		if self.is_terminal(): return list()
 		# cache actions
 		if self.actions == None:
 			(_, count) = util.pick_ban_order[self.pick_ban_position]
-			self.actions = list(itertools.combinations(util.all_heroes.difference(self.radiant_heroes.union(self.dire_heroes).union(self.banned_heroes)), count))
+			self.actions = list(itertools.combinations(self.available_heroes(), count))
 		return self.actions
+	def iter_actions(self):
+		if self.is_terminal(): return iter(())
+		(_, count) = util.pick_ban_order[self.pick_ban_position]
+		return itertools.combinations(self.available_heroes(), count)
+	def action_count(self):
+		if self.is_terminal(): return 0
+		(_, count) = util.pick_ban_order[self.pick_ban_position]
+		return math.comb(count_heroes(hero_pool()[1] & ~self.unavailable_mask()), count)
+	# Uniformly sample an action without building the action list.
+	# Heroes are drawn from the pool until enough available ones are found, which only takes a few tries as long as most of the pool is available.
 	def choose_random_action(self):
-		actions = self.get_actions()
-		return random.choice(actions)
+		(_, count) = util.pick_ban_order[self.pick_ban_position]
+		(pool, pool_mask) = hero_pool()
+		available = pool_mask & ~self.unavailable_mask()
+		if count_heroes(available) * 2 < len(pool):
+			return tuple(sorted(random.sample(mask_to_heroes(available), count)))
+		heroes = list()
+		while len(heroes) < count:
+			hero = random.choice(pool)
+			bit = 1 << hero
+			if available & bit:
+				available ^= bit
+				heroes.append(hero)
+		if count > 1: heroes.sort()
+		return tuple(heroes)
 	def radiant_moved(self):
 		return not self.radiant_moves_next
 	def get_next_state(self, action):
 		(pick_ban, _) = util.pick_ban_order[self.pick_ban_position]
-		state = State(not self.radiant_moves_next, self.radiant_heroes, self.dire_heroes, self.banned_heroes, self.pick_ban_position+1)
+		state = State.__new__(State)
+		state.radiant_mask = self.radiant_mask
+		state.dire_mask = self.dire_mask
+		state.banned_mask = self.banned_mask
+		state.radiant_count = self.radiant_count
+		state.dire_count = self.dire_count
+		state.radiant_moves_next = not self.radiant_moves_next
+		state.pick_ban_position = self.pick_ban_position + 1
+		state.actions = None
+		state.feature_indices = self.feature_indices
+		mask = heroes_to_mask(action)
 		if pick_ban == util.pick:
 			if self.radiant_moved():
-				state.dire_heroes = self.dire_heroes.union(action)
+				state.dire_mask |= mask
+				state.dire_count += len(action)
+				state.feature_indices += tuple(util.hero_count + i for i in action)
+				zobrist = zobrist_dire
 			else:
-				state.radiant_heroes = self.radiant_heroes.union(action)
+				state.radiant_mask |= mask
+				state.radiant_count += len(action)
+				state.feature_indices += action
+				zobrist = zobrist_radiant
 		else:
-			state.banned_heroes = self.banned_heroes.union(action)
+			state.banned_mask |= mask
+			zobrist = zobrist_banned
+		key = self.zobrist
+		for i in action: key ^= zobrist[i]
+		state.zobrist = key
 		return state
 	def str(self):
 		result = 'Banned: '
@@ -45,4 +157,68 @@ class State:
 		result += 'Dire: '
 		for i in self.dire_heroes: result += str(i) + ' '
 		result += 'Radiant moved: ' + str(self.radiant_moved())
-		return result
\ No newline at end of file
+		return result
+
+# The actions of a state that have not been tried yet, returned in random order by pop.
+# While at least half of the actions are untried they are found by sampling random actions and skipping tried ones, so nothing but the tried set is stored.
+# After that the remaining actions are listed and shuffled once, which costs time and memory proportional to the number of actions that were already tried.
+class UntriedActions:
+	__slots__ = ('state', 'remaining', 'tried', 'pending')
+	def __init__(self, state):
+		self.state = state
+		self.remaining = state.action_count()
+		self.tried = None
+		self.pending = None
+	def __len__(self):
+		return self.remaining
+	def pop(self):
+		if self.pending is None and self.remaining >= (len(self.tried) if self.tried else 0):
+			if self.tried is None: self.tried = set()
+			action = self.state.choose_random_action()
+			while action in self.tried:
+				action = self.state.choose_random_action()
+			self.tried.add(action)
+		else:
+			if self.pending is None:
+				self.pending = [a for a in self.state.iter_actions() if a not in self.tried]
+				random.shuffle(self.pending)
+				self.tried = None
+			action = self.pending.pop()
+		self.remaining -= 1
+		return action
+
+# A uniformly random hero of a mask of available heroes, drawn like in State.choose_random_action.
+def random_hero(available):
+	(pool, _) = hero_pool()
+	if count_heroes(available) * 2 < len(pool):
+		return random.choice(mask_to_heroes(available))
+	while True:
+		hero = random.choice(pool)
+		if available & (1 << hero):
+			return hero
+
+# The choice of one hero of an action of several heroes, when such an action is split into one decision per hero (move groups, see mcts_transpositions).
+# chosen are the heroes of the action that were chosen before. It has the methods of State that UntriedActions uses, its actions are tuples of one hero.
+class SubDecision:
+	__slots__ = ('state', 'chosen', 'available')
+	def __init__(self, state, chosen=()):
+		self.state = state
+		self.chosen = chosen
+		(_, pool_mask) = hero_pool()
+		self.available = pool_mask & ~state.unavailable_mask() & ~heroes_to_mask(chosen)
+	def action_count(self):
+		return count_heroes(self.available)
+	def iter_actions(self):
+		return ((hero,) for hero in mask_to_heroes(self.available))
+	def choose_random_action(self):
+		return (random_hero(self.available),)
+	# the whole action with the chosen heroes and random other ones
+	def complete_action(self):
+		(_, count) = util.pick_ban_order[self.state.pick_ban_position]
+		available = self.available
+		heroes = list(self.chosen)
+		while len(heroes) < count:
+			hero = random_hero(available)
+			available ^= 1 << hero
+			heroes.append(hero)
+		return tuple(sorted(heroes))
\ No newline at end of file
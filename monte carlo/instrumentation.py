@@ -0,0 +1,110 @@
+import collections
+import signal
+import threading
+import time
+
+"""
+Counters, timers and an optional sampling profiler for mcts.uct_search and mcts_transpositions.uct_search.
+
+Pass a SearchStats as stats to a search to fill it in. Without stats the searches take their usual path, the instrumentation costs nothing then.
+"""
+
+class SearchStats:
+	# With sample_interval the search thread is also sampled by a SamplingProfiler every sample_interval seconds.
+	def __init__(self, sample_interval=None):
+		self.iterations = 0
+		self.expansions = 0
+		# number of actions played by the rollouts
+		self.rollout_actions = 0
+		# calls to the evaluator and the drafts evaluated by them, more than one per call with batches. A CachedEvaluator answers some drafts from its cache, see cache_hits and cache_misses.
+		self.evaluation_calls = 0
+		self.evaluations = 0
+		self.cache_hits = 0
+		self.cache_misses = 0
+		self.tree_policy_time = 0.0
+		self.rollout_time = 0.0
+		self.evaluation_time = 0.0
+		self.backup_time = 0.0
+		self.total_time = 0.0
+		self.profiler = SamplingProfiler(sample_interval) if sample_interval is not None else None
+		self.start_time = None
+		self.start_cache = None
+	def start(self, model):
+		self.start_time = time.perf_counter()
+		self.start_cache = cache_counts(model)
+		if self.profiler is not None: self.profiler.start()
+	def stop(self, model):
+		if self.profiler is not None: self.profiler.stop()
+		self.total_time += time.perf_counter() - self.start_time
+		(hits, misses) = cache_counts(model)
+		self.cache_hits += hits - self.start_cache[0]
+		self.cache_misses += misses - self.start_cache[1]
+	# iterations that played rollout_actions actions and evaluated their drafts with one call to the evaluator, and the time of each step
+	def add(self, iterations, rollout_actions, evaluations, tree_policy_time, rollout_time, evaluation_time, backup_time):
+		self.iterations += iterations
+		self.rollout_actions += rollout_actions
+		self.evaluation_calls += 1
+		self.evaluations += evaluations
+		self.tree_policy_time += tree_policy_time
+		self.rollout_time += rollout_time
+		self.evaluation_time += evaluation_time
+		self.backup_time += backup_time
+	def as_dict(self):
+		result = {name: value for name, value in vars(self).items() if not name.startswith('start') and name != 'profiler'}
+		if self.profiler is not None: result['profile'] = self.profiler.top()
+		return result
+	def summary(self):
+		total = self.total_time if self.total_time > 0 else 1
+		lines = [
+			'{} iterations in {:.3f} s ({:.0f}/s), {} expansions, {:.1f} actions per rollout.'.format(self.iterations, self.total_time, self.iterations / total, self.expansions, self.rollout_actions / max(1, self.evaluations)),
+			'{} evaluation calls for {} drafts, {} cache hits and {} misses.'.format(self.evaluation_calls, self.evaluations, self.cache_hits, self.cache_misses),
+			'Time: tree policy {:.0%}, rollout {:.0%}, evaluation {:.0%}, backup {:.0%}.'.format(self.tree_policy_time / total, self.rollout_time / total, self.evaluation_time / total, self.backup_time / total),
+		]
+		if self.profiler is not None: lines.append(self.profiler.report())
+		return '\n'.join(lines)
+
+def cache_counts(model):
+	return (getattr(model, 'hits', 0), getattr(model, 'misses', 0))
+
+# Samples the stack of the main thread every interval seconds of processor time and counts in how many samples each function is running (self) or on the stack (total).
+# A SIGPROF timer interrupts the search wherever it is, so this only works on Unix and when the search runs in the main thread. Otherwise start does nothing.
+class SamplingProfiler:
+	def __init__(self, interval=0.001):
+		self.interval = interval
+		self.samples = 0
+		self.self_counts = collections.Counter()
+		self.total_counts = collections.Counter()
+		self.previous_handler = None
+		self.running = False
+	def start(self):
+		if not hasattr(signal, 'setitimer') or threading.current_thread() is not threading.main_thread():
+			return
+		self.previous_handler = signal.signal(signal.SIGPROF, self.sample)
+		signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+		self.running = True
+	def stop(self):
+		if not self.running: return
+		signal.setitimer(signal.ITIMER_PROF, 0)
+		signal.signal(signal.SIGPROF, self.previous_handler)
+		self.running = False
+	def sample(self, signum, frame):
+		self.samples += 1
+		self.self_counts[function_name(frame)] += 1
+		seen = set()
+		while frame is not None:
+			name = function_name(frame)
+			if name not in seen:
+				self.total_counts[name] += 1
+				seen.add(name)
+			frame = frame.f_back
+	def top(self, count=10):
+		return [(name, self.self_counts[name], self.total_counts[name]) for (name, _) in self.self_counts.most_common(count)]
+	def report(self, count=10):
+		lines = ['{} samples, self and total share of the functions with the most samples:'.format(self.samples)]
+		for (name, self_count, total_count) in self.top(count):
+			lines.append('{:6.1%} {:6.1%}  {}'.format(self_count / max(1, self.samples), total_count / max(1, self.samples), name))
+		return '\n'.join(lines)
+
+def function_name(frame):
+	code = frame.f_code
+	return '{}:{}'.format(code.co_filename.rsplit('/', 1)[-1], code.co_name)
\ No newline at end of file
@@ -1,8 +1,18 @@
+import time
+# taken before the other imports to measure the time to the first prompt
+start_time = time.perf_counter()
+
 import argparse
+import threading
 
+import evaluators
+import instrumentation
 import mcts
 import mcts_transpositions
+import parallel
+import rollout
 import util
+import winrates
 from gamestate import State
 
 def ask_question(question, answers):
@@ -34,14 +44,41 @@ def get_pick(state, pick_ban, count):
 		if len(heroes) != count:
 			print('Wrong number of heroes')
 			continue
-		return tuple(heroes)
+		# actions are tuples of hero ids in ascending order
+		return tuple(sorted(heroes))
 
 def print_state(state):
 		print('Banned:', [util.simple_heroes.ordered_to_name(i) for i in state.banned_heroes])
 		print('Radiant:', [util.simple_heroes.ordered_to_name(i) for i in state.radiant_heroes])
 		print('Dire:', [util.simple_heroes.ordered_to_name(i) for i in state.dire_heroes])
 
-def real_game(modelname, time_limit, recommendation_count):
+def print_cache_phase(pick_ban_position, hits, misses):
+	lookups = hits + misses
+	print('Pick/ban {}: {:.1%} of {} evaluations were cache hits.'.format(pick_ban_position + 1, hits / lookups if lookups != 0 else 0.0, lookups))
+
+# Keeps searching the tree in the background while the program waits for input, in slices of slice_time seconds until stop is called.
+# Only used with the transposition search, whose tree stays valid when the next action is applied.
+class Ponderer:
+	def __init__(self, model, node, transpositions, batch_size=1, slice_time=0.05, widening=None, rollouts_per_leaf=1):
+		self.simulations = 0
+		self.stopped = threading.Event()
+		self.thread = threading.Thread(target=self.run, args=(model, node, transpositions, batch_size, slice_time, widening, rollouts_per_leaf), daemon=True)
+		self.thread.start()
+	def run(self, model, node, transpositions, batch_size, slice_time, widening, rollouts_per_leaf):
+		while not self.stopped.is_set() and not node.state.is_terminal():
+			visit_count = node.visit_count
+			mcts_transpositions.uct_search(model, initial_node=node, transpositions=transpositions, time_limit=slice_time, batch_size=batch_size, widening=widening, rollouts_per_leaf=rollouts_per_leaf)
+			self.simulations += node.visit_count - visit_count
+	# returns the number of simulations added to the tree
+	def stop(self):
+		self.stopped.set()
+		self.thread.join()
+		return self.simulations
+
+def real_game(modelname, time_limit, recommendation_count, batch_size=1, verbose=False, parallel_mode="none", workers=1, cache_size=0, rollout_policy="uniform", ponder=True, transposition_memory=None, search_stats=False, profile_interval=None, move_groups=False, widening=None, rollouts_per_leaf=1):
+	# the models are loaded while the user answers the questions, the one used by MCTS first
+	loader = util.ModelLoader([modelname] + [name for name in util.all_models if name != modelname])
+	if verbose: print('Time to first prompt: {:.2f} seconds'.format(time.perf_counter() - start_time))
 	mode = ask_question("What gamemode are you playing?", ["ap", "cm"])
 	side = ask_question("Which side are you playing on?", ["radiant", "dire"])
 	first = ask_question("Do you have first pick / ban?", ["y", "n"])
@@ -50,11 +87,23 @@ def real_game(modelname, time_limit, recommendation_count):
 		util.pick_ban_order = util.allpick_order
 	else:
 		util.pick_ban_order = util.cm_order
+	util.move_groups = move_groups
 		
 	radiant_goes_first = (side == "radiant" and first == "y") or (side == "dire" and first == "n")
 	node = mcts_transpositions.Node(mcts.State(radiant_goes_first))
-	transpositions = dict()
-	model = util.load_model(modelname)
+	transpositions = mcts_transpositions.TranspositionTable(transposition_memory)
+	model = loader.get(modelname)
+	if rollout_policy == "informed":
+		# counts the matches that are new since the statistics were last cached
+		util.rollout_policy = rollout.InformedPolicy(winrates.winrates)
+	if cache_size > 0:
+		# the cache lives for the whole draft so later searches reuse the evaluations of earlier ones
+		model = evaluators.CachedEvaluator(model, cache_size)
+		cache_phases = list()
+		if rollouts_per_leaf > 1:
+			print('Note: the drafts of several rollouts per leaf are evaluated without the cache, the cache hit rates only count the other evaluations.')
+	if parallel_mode == "root":
+		pool = parallel.create_pool(model, workers)
 	players_turn = (side == "radiant" and node.state.radiant_moves_next) or (side == "dire" and not node.state.radiant_moves_next)
 	while not node.state.is_terminal():
 		print_state(node.state)
@@ -67,40 +116,86 @@ def real_game(modelname, time_limit, recommendation_count):
 		
 		if players_turn:
 			print("It is your turn. MCTS recommends the following heroes: ...")
-			(_, root_node, transpositions) = mcts_transpositions.uct_search(model,initial_node=node, time_limit=time_limit, transpositions=transpositions)
+			if cache_size > 0: (hits, misses) = (model.hits, model.misses)
+			if parallel_mode == "root":
+				# the merged root only has one level of children and they carry the statistics themselves
+				(_, root_node) = parallel.root_parallel_search(pool, node.state, workers, time_limit=time_limit, verbose=verbose, rollouts_per_leaf=rollouts_per_leaf)
+				def to_transpo(n): return n
+				def to_action(n): return n.incoming_action
+			else:
+				if parallel_mode == "tree":
+					(_, root_node, transpositions) = parallel.tree_parallel_search(model, workers, initial_node=node, transpositions=transpositions, time_limit=time_limit, verbose=verbose, widening=widening, rollouts_per_leaf=rollouts_per_leaf)
+				else:
+					stats = instrumentation.SearchStats(profile_interval) if search_stats else None
+					(_, root_node, transpositions) = mcts_transpositions.uct_search(model,initial_node=node, time_limit=time_limit, transpositions=transpositions, batch_size=batch_size, verbose=verbose, stats=stats, widening=widening, rollouts_per_leaf=rollouts_per_leaf)
+					if stats is not None: print(stats.summary())
+				def to_transpo(n): return mcts_transpositions.get_statistics(n, transpositions)
+				# with move groups the children are the first heroes of the action, shown with the best rest of the action
+				def to_action(n): return mcts_transpositions.full_action(n, transpositions)
 			node = root_node
-			def to_transpo(n): return transpositions[mcts_transpositions.state_to_key(n.state)]
+			if cache_size > 0 and parallel_mode != "root":
+				cache_phases.append((node.state.pick_ban_position, model.hits - hits, model.misses - misses))
+				print_cache_phase(*cache_phases[-1])
 			children = sorted(root_node.children, key=lambda n: to_transpo(n).total_simulated_reward / to_transpo(n).visit_count, reverse=True)
 			for c in children[:recommendation_count]:
-				print([util.simple_heroes.ordered_to_name(i) for i in c.incoming_action], to_transpo(c).total_simulated_reward / to_transpo(c).visit_count, to_transpo(c).visit_count)
+				print([util.simple_heroes.ordered_to_name(i) for i in to_action(c)], to_transpo(c).total_simulated_reward / to_transpo(c).visit_count, to_transpo(c).visit_count)
 		else:
 			print("It is the other team's turn. What did they do?")
 		players_turn = not players_turn
+		# the root parallel search does not keep a tree to continue
+		ponderer = Ponderer(model, node, transpositions, batch_size, widening=widening, rollouts_per_leaf=rollouts_per_leaf) if ponder and parallel_mode != "root" else None
 		choice = get_pick(node.state, pick_ban, count)
+		if ponderer is not None:
+			pondered = ponderer.stop()
+			if verbose: print('Searched', pondered, 'simulations while waiting.')
 		
 		print()
 		assert(set(choice) in choices_sets)
-		found = False
-		for n in node.children:
-			if n.incoming_action == choice:
-				node = n
-				node.parent = None
-				node.incoming_action = None
-				found = True
-		if not found:
-			node = mcts.Node(node.state.get_next_state(choice))
+		child = mcts_transpositions.find_child(node, choice)
+		if child is not None:
+			node = child
+			node.parent = None
+			node.incoming_action = None
+		else:
+			node = mcts_transpositions.Node(node.state.get_next_state(choice))
+		print('Carried over', node.visit_count, 'simulations to the next decision.')
+		# the root parallel search keeps mcts.Node trees and no transposition table
+		if parallel_mode == "root": continue
+		# only the positions of the kept tree can come up again
+		transpositions.new_move(node)
+		if verbose: print('Transposition table: {} entries, {:.1f} MB, {} evicted so far.'.format(len(transpositions), transpositions.memory() / 2**20, transpositions.evicted))
+	if parallel_mode == "root":
+		pool.terminate()
+	if cache_size > 0 and len(cache_phases) != 0:
+		print('Evaluation cache hit rates per draft phase:')
+		for phase in cache_phases: print_cache_phase(*phase)
 	print('Done!')
+	draft_end_time = time.perf_counter()
 	print_state(node.state)
 	print('Predicting Radiant win probability with all models:')
 	for model_name in util.all_models:
-		model = util.load_model(model_name)
-		print(model_name,':', util.predict_radiant_win_probability(util.state_to_feature(node.state), model))
+		model = loader.get(model_name)
+		print(model_name,':', util.predict_state_radiant_win_probability(node.state, model))
+	if verbose: print('Time to final prediction: {:.2f} seconds'.format(time.perf_counter() - draft_end_time))
 
 if __name__ == '__main__':
 	parser = argparse.ArgumentParser()
 	parser.add_argument("--time-limit", type=float, default=1.0)
 	parser.add_argument("--recommendation-count", type=int, default=10)
+	parser.add_argument("--batch-size", type=int, default=1, help="Number of leaves MCTS evaluates with one call to the model.")
+	parser.add_argument("--verbose", action="store_true", help="Print the number of MCTS iterations per second and the startup and final prediction times.")
+	parser.add_argument("--parallel", choices=["none", "root", "tree"], default="none", help="Root parallel search runs independent searches in worker processes, tree parallel search shares one tree between threads.")
+	parser.add_argument("--workers", type=int, default=4, help="Number of processes or threads used by --parallel.")
+	parser.add_argument("--cache-size", type=int, default=100000, help="Number of evaluated drafts to remember during the game. 0 disables the cache.")
+	parser.add_argument("--rollout-policy", choices=["uniform", "informed"], default="uniform", help="Complete drafts in the rollouts with uniformly random actions or in proportion to the hero statistics of winrates.py.")
+	parser.add_argument("--transposition-memory", type=float, default=512, help="Memory limit of the transposition table in MB.")
+	parser.add_argument("--stats", action="store_true", help="Print counters and the time split of every search.")
+	parser.add_argument("--profile", type=float, metavar="INTERVAL", help="With --stats, also sample the search every INTERVAL seconds and print the functions it spends the most time in.")
+	parser.add_argument("--move-groups", action="store_true", help="Search actions of several heroes one hero at a time.")
+	parser.add_argument("--widening", type=float, nargs=2, metavar=("C", "ALPHA"), help="Progressive widening: a node with N visits gets at most C * N**ALPHA children.")
+	parser.add_argument("--rollouts-per-leaf", type=int, default=1, help="Number of rollouts whose mean reward is backed up from every leaf. More than one are played at once with numpy and evaluated without the --cache-size cache.")
+	parser.add_argument("--no-ponder", action="store_true", help="Do not search while waiting for the picks and bans.")
 	parser.add_argument("models", nargs="+", help="Available previously generated models. First one will be used by MCTS, and the others to compare the final team composition.")
 	args = parser.parse_args()
 	util.all_models = args.models
-	real_game(args.models[0], args.time_limit, args.recommendation_count)
\ No newline at end of file
+	real_game(args.models[0], args.time_limit, args.recommendation_count, args.batch_size, args.verbose, args.parallel, args.workers, args.cache_size, args.rollout_policy, not args.no_ponder, int(args.transposition_memory * 2**20), args.stats, args.profile, args.move_groups, args.widening, args.rollouts_per_leaf)
\ No newline at end of file
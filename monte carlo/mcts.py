@@ -1,9 +1,10 @@
 import math
-import random
 import time
-from copy import copy
 
-from gamestate import State
+import numpy as np
+
+from gamestate import State, UntriedActions
+import rollout
 import util
 
 """
@@ -20,27 +21,91 @@ This code is inspired by:
 Readable online here: http://www.cameronius.com/cv/mcts-survey-master.pdf
 """
 
-def uct_search(model, initial_state=None, initial_node=None, time_limit=None, iteration_limit=None, Cp=2**-3):
+# With batch_size > 1 the search selects batch_size leaves at a time, using virtual loss to spread them over the tree,
+# and evaluates all of their rollouts with a single call to the model.
+# With rollouts_per_leaf > 1 the reward of a leaf is the mean of that many rollouts, which are played and evaluated together (see random_playouts).
+# stats is an optional instrumentation.SearchStats that is filled in by the search.
+def uct_search(model, initial_state=None, initial_node=None, time_limit=None, iteration_limit=None, Cp=2**-3, batch_size=1, verbose=False, stats=None, rollouts_per_leaf=1):
 	assert((initial_state is None) ^ (initial_node is None))
 	if not initial_node is None:
 		root_node = initial_node
 	else:
 		root_node = Node(initial_state)
 	assert((time_limit is None) ^ (iteration_limit is None))
+	if stats is not None:
+		stats.start(model)
+		select = lambda: tree_policy(root_node, Cp)
 	start_time = time.time()
 	iteration_count = 0
 	while (time.time() - start_time) < time_limit if iteration_limit is None else iteration_count < iteration_limit:
-		node = tree_policy(root_node, Cp)
-		reward = default_policy(node.state, model)
-		backup(node, reward)
-		iteration_count += 1
-	#print('finished', iteration_count, 'iterations in', time_limit, 'seconds.')
+		if batch_size == 1:
+			if stats is None:
+				node = tree_policy(root_node, Cp)
+				reward = default_policy(node.state, model, rollouts_per_leaf)
+				backup(node, reward)
+			else:
+				timed_iteration(select, backup, model, stats, rollouts=rollouts_per_leaf)
+			iteration_count += 1
+		else:
+			count = batch_size if iteration_limit is None else min(batch_size, iteration_limit - iteration_count)
+			iteration_count += batched_iteration(root_node, Cp, model, count, stats, rollouts_per_leaf)
+	if stats is not None: stats.stop(model)
+	if verbose: print_search_speed(iteration_count, time.time() - start_time)
 	best = best_child(root_node, 0)
 	return (best, root_node)
 
+def batched_iteration(root_node, Cp, model, batch_size, stats=None, rollouts=1):
+	if stats is not None: start = time.perf_counter()
+	leaves = list()
+	for _ in range(batch_size):
+		node = tree_policy(root_node, Cp)
+		if stats is not None and node.visit_count == 0: stats.expansions += 1
+		add_virtual_loss(node, 1)
+		leaves.append(node)
+	if stats is not None: selected = time.perf_counter()
+	initial_states = [node.state for node in leaves]
+	if rollouts == 1:
+		terminal_states = [random_playout(state) for state in initial_states]
+		if stats is not None: played = time.perf_counter()
+		rewards = compute_rewards(terminal_states, [state.radiant_moved() for state in initial_states], model)
+	else:
+		drafts = random_playouts(initial_states, rollouts)
+		if stats is not None: played = time.perf_counter()
+		rewards = compute_mean_rewards(drafts, initial_states, rollouts, model)
+	if stats is not None: evaluated = time.perf_counter()
+	for node, reward in zip(leaves, rewards):
+		add_virtual_loss(node, -1)
+		backup(node, reward)
+	if stats is not None:
+		stats.add(len(leaves), rollouts * sum(map(remaining_actions, initial_states)), rollouts * len(leaves), selected - start, played - selected, evaluated - played, time.perf_counter() - evaluated)
+	return len(leaves)
+
+# One iteration with the time of each step recorded in stats. select returns the leaf to simulate from and update(node, reward) backs up the reward.
+# playout_state(node) returns the state the rollout starts from if that is not the state of the leaf.
+def timed_iteration(select, update, model, stats, playout_state=None, rollouts=1):
+	start = time.perf_counter()
+	node = select()
+	selected = time.perf_counter()
+	if node.visit_count == 0: stats.expansions += 1
+	initial_state = node.state if playout_state is None else playout_state(node)
+	if rollouts == 1:
+		state = random_playout(initial_state)
+		played = time.perf_counter()
+		reward = compute_reward(state, initial_state.radiant_moved(), model)
+	else:
+		drafts = random_playouts((initial_state,), rollouts)
+		played = time.perf_counter()
+		(reward,) = compute_mean_rewards(drafts, (initial_state,), rollouts, model)
+	evaluated = time.perf_counter()
+	update(node, reward)
+	stats.add(1, rollouts * remaining_actions(node.state), rollouts, selected - start, played - selected, evaluated - played, time.perf_counter() - evaluated)
+
+def print_search_speed(iteration_count, duration):
+	print('finished', iteration_count, 'iterations in', round(duration, 3), 'seconds ({:.0f} iterations/s).'.format(iteration_count / duration if duration > 0 else 0))
+
 def tree_policy(node, Cp):
 	while not node.state.is_terminal():
-		if len(node.remaining_actions) != 0:
+		if len(node.untried_actions) != 0:
 			return node.expand()
 		else:
 			node = best_child(node, Cp)
@@ -51,20 +116,51 @@ def best_child(node, Cp):
 	return max(node.children, key=lambda n:
 		n.total_simulated_reward / n.visit_count + Cp * math.sqrt( constant / n.visit_count))
 
-def default_policy(state, model):
+def default_policy(state, model, rollouts=1):
+	if rollouts != 1:
+		return compute_mean_rewards(random_playouts((state,), rollouts), (state,), rollouts, model)[0]
 	for_radiant = state.radiant_moved()
+	state = random_playout(state)
+	return compute_reward(state, for_radiant, model)
+
+def remaining_actions(state):
+	return len(util.pick_ban_order) - state.pick_ban_position
+
+# Completes the draft with util.rollout_policy, or with uniformly random actions if there is none.
+def random_playout(state):
+	policy = util.rollout_policy
 	while not state.is_terminal():
-		action = state.choose_random_action()
+		action = state.choose_random_action() if policy is None else policy.choose_action(state)
 		state = state.get_next_state(action)
-	return compute_reward(state, for_radiant, model)
+	return state
+
+# rollouts rollouts from each of the states, in the order of the states.
+# Without util.rollout_policy all of them are played at once by rollout.random_drafts and returned as the rows of one feature matrix, otherwise they are the terminal states of random_playout.
+def random_playouts(states, rollouts):
+	if util.rollout_policy is None:
+		return np.concatenate([rollout.random_drafts(state, rollouts) for state in states])
+	return [random_playout(state) for state in states for _ in range(rollouts)]
 	
 # Reward is the probability of winning
 def compute_reward(state, for_radiant, model):
-	feature = util.state_to_feature(state)
-	radiant_win = util.predict_radiant_win_probability(feature, model)
+	radiant_win = util.predict_state_radiant_win_probability(state, model)
 	if for_radiant: return radiant_win
 	else: return 1 - radiant_win
 
+# Same as compute_reward for many terminal states at once, using one call to the model
+def compute_rewards(states, for_radiant, model):
+	radiant_wins = util.predict_state_radiant_win_probabilities(states, model)
+	return [radiant_win if r else 1 - radiant_win for radiant_win, r in zip(radiant_wins, for_radiant)]
+
+# The mean reward of the rollouts of each of the states returned by random_playouts, using one call to the model
+def compute_mean_rewards(drafts, states, rollouts, model):
+	if isinstance(drafts, np.ndarray):
+		radiant_wins = util.predict_radiant_win_probabilities(drafts, model)
+	else:
+		radiant_wins = util.predict_state_radiant_win_probabilities(drafts, model)
+	means = np.reshape(radiant_wins, (len(states), rollouts)).mean(axis=1).tolist()
+	return [radiant_win if state.radiant_moved() else 1 - radiant_win for radiant_win, state in zip(means, states)]
+
 def backup(node, reward):
 	while node != None:
 		node.visit_count += 1
@@ -72,6 +168,13 @@ def backup(node, reward):
 		reward = 1 - reward
 		node = node.parent		
 
+# Virtual loss counts a pending evaluation as a visit without reward, so that the other leaves of a batch are selected elsewhere.
+# Call with amount -1 to remove it again before the real backup.
+def add_virtual_loss(node, amount):
+	while node != None:
+		node.visit_count += amount
+		node = node.parent
+
 class Node:
 	def __init__(self, state=State(), incoming_action=None, parent=None, total_simulated_reward=0, visit_count=0):
 		self.state = state # s(v)
@@ -80,10 +183,9 @@ class Node:
 		self.total_simulated_reward  = total_simulated_reward # Q(v)
 		self.visit_count = visit_count # N(v)
 		self.children = list()
-		self.remaining_actions = copy(self.state.get_actions())
+		self.untried_actions = UntriedActions(state)
 	def expand(self):
-		action = random.choice(self.remaining_actions)
-		self.remaining_actions.remove(action)
+		action = self.untried_actions.pop()
 		child = Node(self.state.get_next_state(action), action, self)
 		self.children.append(child)
 		return child
\ No newline at end of file
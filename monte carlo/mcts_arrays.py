@@ -0,0 +1,222 @@
+import math
+import time
+
+import numpy as np
+
+from gamestate import State, UntriedActions
+from mcts import default_policy, random_playout, random_playouts, compute_rewards, compute_mean_rewards, remaining_actions, print_search_speed, timed_iteration
+import util
+
+"""
+The search of mcts.py on a tree that is stored in numpy arrays instead of one Node object per node.
+
+Nodes are indices into the arrays of a Tree. Visit counts, rewards, parent, first child, next sibling and the incoming action of every node are array entries,
+so growing the tree allocates nothing but the State of the new node, and best_child scores all children of a node with a few vectorized operations.
+The random numbers are drawn in the same order as in mcts.py and the scores are computed with the same floating point operations,
+so with the same seed both searches grow the same tree and recommend the same action.
+"""
+
+class Tree:
+	def __init__(self, state=State(), capacity=1024):
+		# actions have at most this many heroes, shorter ones are padded with -1
+		self.action_size = max(count for (_, count) in util.pick_ban_order)
+		self.size = 0
+		self.visit_count = np.zeros(capacity, dtype=np.int64) # N(v)
+		self.total_simulated_reward = np.zeros(capacity) # Q(v)
+		self.parent = np.zeros(capacity, dtype=np.int64)
+		self.first_child = np.zeros(capacity, dtype=np.int64)
+		self.next_sibling = np.zeros(capacity, dtype=np.int64)
+		self.action = np.zeros((capacity, self.action_size), dtype=np.int16) # a(v)
+		self.states = list() # s(v)
+		# created when the node is first selected and dropped when all of its actions are tried
+		self.untried_actions = list()
+		# the children of a node as an index array, set once all of its actions are tried and its children do not change anymore
+		self.child_indices = list()
+		self.add(-1, (), state)
+	def grow(self):
+		capacity = 2 * len(self.visit_count)
+		for name in ('visit_count', 'total_simulated_reward', 'parent', 'first_child', 'next_sibling', 'action'):
+			old = getattr(self, name)
+			new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+			new[:len(old)] = old
+			setattr(self, name, new)
+	# Returns the index of a new node. Children are linked in front of their siblings.
+	def add(self, parent, action, state):
+		if self.size == len(self.visit_count): self.grow()
+		index = self.size
+		self.size += 1
+		self.parent[index] = parent
+		self.first_child[index] = -1
+		self.action[index] = -1
+		self.action[index, :len(action)] = action
+		if parent >= 0:
+			self.next_sibling[index] = self.first_child[parent]
+			self.first_child[parent] = index
+		else:
+			self.next_sibling[index] = -1
+		self.states.append(state)
+		self.untried_actions.append(None)
+		self.child_indices.append(None)
+		return index
+	# the children of a node in the order they were expanded
+	def children(self, index):
+		children = list()
+		child = self.first_child[index]
+		while child >= 0:
+			children.append(child)
+			child = self.next_sibling[child]
+		children.reverse()
+		return children
+	def expand(self, index):
+		action = self.untried_actions[index].pop()
+		return self.add(index, action, self.states[index].get_next_state(action))
+	def node(self, index):
+		return Node(self, index)
+	def __len__(self):
+		return self.size
+	# approximate size in bytes of the arrays, without the states
+	def memory(self):
+		return sum(getattr(self, name).nbytes for name in ('visit_count', 'total_simulated_reward', 'parent', 'first_child', 'next_sibling', 'action'))
+
+# A view of one node of a Tree with the attributes of mcts.Node, used as the result of uct_search and as its initial_node.
+# A search from a node only updates its subtree, the nodes above it and other subtrees stay in the arrays until the tree is dropped.
+class Node:
+	__slots__ = ('tree', 'index')
+	def __init__(self, tree, index=0):
+		self.tree = tree
+		self.index = index
+	def __eq__(self, other):
+		return isinstance(other, Node) and self.tree is other.tree and self.index == other.index
+	def __hash__(self):
+		return hash((id(self.tree), self.index))
+	@property
+	def state(self):
+		return self.tree.states[self.index]
+	@property
+	def incoming_action(self):
+		action = tuple(int(hero) for hero in self.tree.action[self.index] if hero >= 0)
+		return action if len(action) != 0 else None
+	@incoming_action.setter
+	def incoming_action(self, action):
+		self.tree.action[self.index] = -1
+		if action is not None: self.tree.action[self.index, :len(action)] = action
+	@property
+	def parent(self):
+		parent = self.tree.parent[self.index]
+		return Node(self.tree, int(parent)) if parent >= 0 else None
+	# only detaching a node with parent = None is supported, its old parent still lists it as a child
+	@parent.setter
+	def parent(self, parent):
+		assert(parent is None)
+		self.tree.parent[self.index] = -1
+	@property
+	def visit_count(self):
+		return int(self.tree.visit_count[self.index])
+	@property
+	def total_simulated_reward(self):
+		return float(self.tree.total_simulated_reward[self.index])
+	@property
+	def children(self):
+		return [Node(self.tree, int(child)) for child in self.tree.children(self.index)]
+	@property
+	def untried_actions(self):
+		untried_actions = self.tree.untried_actions[self.index]
+		if untried_actions is None:
+			return () if self.tree.child_indices[self.index] is not None else UntriedActions(self.state)
+		return untried_actions
+
+# Same as mcts.uct_search, initial_node is an mcts_arrays.Node and so are the returned nodes.
+def uct_search(model, initial_state=None, initial_node=None, time_limit=None, iteration_limit=None, Cp=2**-3, batch_size=1, verbose=False, stats=None, rollouts_per_leaf=1):
+	assert((initial_state is None) ^ (initial_node is None))
+	if not initial_node is None:
+		(tree, root) = (initial_node.tree, initial_node.index)
+	else:
+		(tree, root) = (Tree(initial_state), 0)
+	assert((time_limit is None) ^ (iteration_limit is None))
+	if stats is not None:
+		stats.start(model)
+		select = lambda: Node(tree, tree_policy(tree, root, Cp))
+		update = lambda node, reward: backup(tree, node.index, root, reward)
+	start_time = time.time()
+	iteration_count = 0
+	while (time.time() - start_time) < time_limit if iteration_limit is None else iteration_count < iteration_limit:
+		if batch_size == 1:
+			if stats is None:
+				leaf = tree_policy(tree, root, Cp)
+				reward = default_policy(tree.states[leaf], model, rollouts_per_leaf)
+				backup(tree, leaf, root, reward)
+			else:
+				timed_iteration(select, update, model, stats, rollouts=rollouts_per_leaf)
+			iteration_count += 1
+		else:
+			count = batch_size if iteration_limit is None else min(batch_size, iteration_limit - iteration_count)
+			iteration_count += batched_iteration(tree, root, Cp, model, count, stats, rollouts_per_leaf)
+	if stats is not None: stats.stop(model)
+	if verbose: print_search_speed(iteration_count, time.time() - start_time)
+	best = best_child(tree, root, 0)
+	return (Node(tree, int(best)), Node(tree, root))
+
+def batched_iteration(tree, root, Cp, model, batch_size, stats=None, rollouts=1):
+	if stats is not None: start = time.perf_counter()
+	leaves = list()
+	for _ in range(batch_size):
+		leaf = tree_policy(tree, root, Cp)
+		if stats is not None and tree.visit_count[leaf] == 0: stats.expansions += 1
+		add_virtual_loss(tree, leaf, root, 1)
+		leaves.append(leaf)
+	if stats is not None: selected = time.perf_counter()
+	initial_states = [tree.states[leaf] for leaf in leaves]
+	if rollouts == 1:
+		terminal_states = [random_playout(state) for state in initial_states]
+		if stats is not None: played = time.perf_counter()
+		rewards = compute_rewards(terminal_states, [state.radiant_moved() for state in initial_states], model)
+	else:
+		drafts = random_playouts(initial_states, rollouts)
+		if stats is not None: played = time.perf_counter()
+		rewards = compute_mean_rewards(drafts, initial_states, rollouts, model)
+	if stats is not None: evaluated = time.perf_counter()
+	for leaf, reward in zip(leaves, rewards):
+		add_virtual_loss(tree, leaf, root, -1)
+		backup(tree, leaf, root, reward)
+	if stats is not None:
+		stats.add(len(leaves), rollouts * sum(map(remaining_actions, initial_states)), rollouts * len(leaves), selected - start, played - selected, evaluated - played, time.perf_counter() - evaluated)
+	return len(leaves)
+
+def tree_policy(tree, index, Cp):
+	while not tree.states[index].is_terminal():
+		if tree.child_indices[index] is None:
+			untried_actions = tree.untried_actions[index]
+			if untried_actions is None:
+				untried_actions = tree.untried_actions[index] = UntriedActions(tree.states[index])
+			if len(untried_actions) != 0:
+				return tree.expand(index)
+			tree.untried_actions[index] = None
+			tree.child_indices[index] = np.array(tree.children(index), dtype=np.int64)
+		index = best_child(tree, index, Cp)
+	return index
+
+# The first child with the highest score, like max in mcts.best_child.
+def best_child(tree, index, Cp):
+	children = tree.child_indices[index]
+	if children is None:
+		children = np.array(tree.children(index), dtype=np.int64)
+	visit_count = tree.visit_count[children]
+	constant = math.log(tree.visit_count[index])
+	scores = tree.total_simulated_reward[children] / visit_count + Cp * np.sqrt(constant / visit_count)
+	return children[np.argmax(scores)]
+
+# Updates the nodes from index up to the root of the search.
+def backup(tree, index, root, reward):
+	(visit_count, total_simulated_reward, parent) = (tree.visit_count, tree.total_simulated_reward, tree.parent)
+	while True:
+		visit_count[index] += 1
+		total_simulated_reward[index] += reward
+		if index == root: break
+		reward = 1 - reward
+		index = parent[index]
+
+def add_virtual_loss(tree, index, root, amount):
+	while True:
+		tree.visit_count[index] += amount
+		if index == root: break
+		index = tree.parent[index]
\ No newline at end of file
@@ -1,10 +1,10 @@
+import heapq
 import math
-import random
+import sys
 import time
-from copy import copy
 
-from gamestate import State
-from mcts import default_policy
+from gamestate import State, SubDecision, UntriedActions, zobrist_chosen
+from mcts import default_policy, random_playout, random_playouts, compute_rewards, compute_mean_rewards, remaining_actions, print_search_speed, timed_iteration
 import util
 
 """
@@ -21,43 +21,142 @@ The transposition code is inspired by:
 	ISSN={2325-4270},
 	month={Dec}
 }
+
+With util.move_groups an action of several heroes, like the (pick,2) of captains mode, is split into a group of moves that choose one hero each.
+A node of the tree then has a child per hero instead of one per combination of heroes, so UCB can tell good and bad heroes apart after far fewer iterations.
+The nodes within a group have the state before the action and the heroes chosen so far, their rewards are those of the team that makes the action.
+
+With widening = (C, alpha) the search uses progressive widening: a node with N visits gets a new child only while it has fewer than C * N**alpha children.
 """
 
 
+# generation is the move of the draft in which the entry was last updated, see TranspositionTable
 class Transposition:
-	def __init__(self, total_simulated_reward=0, visit_count=0):
+	__slots__ = ('total_simulated_reward', 'visit_count', 'generation')
+	def __init__(self, total_simulated_reward=0, visit_count=0, generation=0):
 		self.total_simulated_reward = total_simulated_reward
 		self.visit_count = visit_count
-		
+		self.generation = generation
+
+# A dict from the Zobrist hashes of states to their Transposition, with a memory limit.
+# When it holds more than max_entries entries, evict removes a quarter of them, first those that were not updated during the current move and among them those with the fewest visits.
+# Nodes keep their own statistics, which stand in for evicted entries (see get_statistics) and are copied into a new entry when the state comes up again.
+# After each real move new_move keeps only the entries of the nodes of the tree that is kept. The positions of the subtrees of the other actions
+# and of earlier moves are dropped, a later node of such a position starts from its own statistics like after an eviction.
+class TranspositionTable(dict):
+	def __init__(self, max_memory=None):
+		self.max_entries = None if max_memory is None else max(1, max_memory // entry_size)
+		self.generation = 0
+		self.evicted = 0
+	def evict(self):
+		if self.max_entries is None or len(self) <= self.max_entries: return
+		victims = heapq.nsmallest(len(self) - self.max_entries * 3 // 4, self.items(), key=lambda item: (item[1].generation, item[1].visit_count))
+		for (key, _) in victims: del self[key]
+		self.evicted += len(victims)
+	def new_move(self, root_node):
+		self.generation += 1
+		reachable = set()
+		nodes = [root_node]
+		while len(nodes) != 0:
+			node = nodes.pop()
+			reachable.add(node_key(node))
+			nodes.extend(node.children)
+		for key in [key for key in self if key not in reachable]: del self[key]
+	# approximate size in bytes of the table and its entries
+	def memory(self):
+		return sys.getsizeof(self) + len(self) * object_size
+	def __repr__(self):
+		return 'TranspositionTable({} entries, {:.1f} MB)'.format(len(self), self.memory() / 2**20)
+
+# Size of the objects of an entry: the hash key, the entry and its float reward. Most visit counts are small ints, which are shared.
+object_size = sys.getsizeof(2**63) + sys.getsizeof(Transposition()) + sys.getsizeof(0.5)
+# plus the share of an entry of the table of a dict, which is resized in powers of two
+entry_size = object_size + sys.getsizeof(dict.fromkeys(range(2**15))) // 2**15
+
 def state_to_key(state):
-	return (state.radiant_heroes, state.dire_heroes, state.banned_heroes)
+	return state.zobrist
+
+# the key of the state of a node and the heroes chosen within its move group
+def node_key(node):
+	key = node.state.zobrist
+	for hero in node.chosen: key ^= zobrist_chosen[hero]
+	return key
 
-def uct_search(model, initial_state=None, initial_node=None, transpositions=dict(), time_limit=None, iteration_limit=None, Cp=2**-5):
+# The statistics of the state of the node, which are those of the node itself if the state has been evicted from the table.
+def get_statistics(node, transpositions):
+	return transpositions.get(node_key(node), node)
+
+# transpositions is a TranspositionTable, or a dict without memory limit. A new unlimited TranspositionTable is used if it is None.
+# stats is an optional instrumentation.SearchStats that is filled in by the search.
+def uct_search(model, initial_state=None, initial_node=None, transpositions=None, time_limit=None, iteration_limit=None, Cp=2**-5, batch_size=1, verbose=False, stats=None, widening=None, rollouts_per_leaf=1):
 	assert((initial_state is None) ^ (initial_node is None))
 	if not initial_node is None:
 		root_node = initial_node
 	else:
 		root_node = Node(initial_state)
 	assert((time_limit is None) ^ (iteration_limit is None))
+	if transpositions is None:
+		transpositions = TranspositionTable()
+	bounded = isinstance(transpositions, TranspositionTable)
 		
-	# keys type is (set(radiant_heroes), set(dire_heroes), set(banned_heroes))
+	# keys are Zobrist hashes as in State.zobrist
 	# value type is Transposition
-	transpositions[state_to_key(root_node.state)] = Transposition()
+	transpositions[node_key(root_node)] = Transposition()
 
+	if stats is not None:
+		stats.start(model)
+		select = lambda: tree_policy(root_node, Cp, transpositions, widening)
+		update = lambda node, reward: backup(node, reward, transpositions)
 	start_time = time.time()
 	iteration_count = 0
 	while (time.time() - start_time) < time_limit if iteration_limit is None else iteration_count < iteration_limit:
-		node = tree_policy(root_node, Cp, transpositions)
-		reward = default_policy(node.state, model)
-		backup(node, reward, transpositions)
-		iteration_count += 1
-	#print('finished', iteration_count, 'iterations in', time_limit, 'seconds.')
+		# only between iterations, when no virtual loss is pending
+		if bounded: transpositions.evict()
+		if batch_size == 1:
+			if stats is None:
+				node = tree_policy(root_node, Cp, transpositions, widening)
+				reward = default_policy(node.playout_state(), model, rollouts_per_leaf)
+				backup(node, reward, transpositions)
+			else:
+				timed_iteration(select, update, model, stats, Node.playout_state, rollouts_per_leaf)
+			iteration_count += 1
+		else:
+			count = batch_size if iteration_limit is None else min(batch_size, iteration_limit - iteration_count)
+			iteration_count += batched_iteration(root_node, Cp, model, count, transpositions, stats, widening, rollouts_per_leaf)
+	if stats is not None: stats.stop(model)
+	if verbose: print_search_speed(iteration_count, time.time() - start_time)
 	best = best_child(root_node, 0, transpositions)
 	return (best, root_node, transpositions)
 
-def tree_policy(node, Cp, transpositions):
+def batched_iteration(root_node, Cp, model, batch_size, transpositions, stats=None, widening=None, rollouts=1):
+	if stats is not None: start = time.perf_counter()
+	leaves = list()
+	for _ in range(batch_size):
+		node = tree_policy(root_node, Cp, transpositions, widening)
+		if stats is not None and node.visit_count == 0: stats.expansions += 1
+		add_virtual_loss(node, 1, transpositions)
+		leaves.append(node)
+	if stats is not None: selected = time.perf_counter()
+	initial_states = [node.playout_state() for node in leaves]
+	if rollouts == 1:
+		terminal_states = [random_playout(state) for state in initial_states]
+		if stats is not None: played = time.perf_counter()
+		rewards = compute_rewards(terminal_states, [state.radiant_moved() for state in initial_states], model)
+	else:
+		drafts = random_playouts(initial_states, rollouts)
+		if stats is not None: played = time.perf_counter()
+		rewards = compute_mean_rewards(drafts, initial_states, rollouts, model)
+	if stats is not None: evaluated = time.perf_counter()
+	for node, reward in zip(leaves, rewards):
+		add_virtual_loss(node, -1, transpositions)
+		backup(node, reward, transpositions)
+	if stats is not None:
+		stats.add(len(leaves), rollouts * sum(map(remaining_actions, initial_states)), rollouts * len(leaves), selected - start, played - selected, evaluated - played, time.perf_counter() - evaluated)
+	return len(leaves)
+
+def tree_policy(node, Cp, transpositions, widening=None):
 	while not node.state.is_terminal():
-		if len(node.remaining_actions) != 0:
+		if len(node.untried_actions) != 0 and (widening is None or len(node.children) < max(1, widening[0] * node.visit_count**widening[1])):
 			return node.expand()
 		else:
 			node = best_child(node, Cp, transpositions)
@@ -66,36 +165,97 @@ def tree_policy(node, Cp, transpositions):
 def best_child(node, Cp, transpositions):
 	constant = math.log(node.visit_count)
 	def value(n):
-		transpo = transpositions[state_to_key(n.state)]
+		transpo = get_statistics(n, transpositions)
 		return transpo.total_simulated_reward / transpo.visit_count + Cp * math.sqrt( constant / n.visit_count)
 	return max(node.children, key=value)		
 
+# The action from node to its child, completed with the best moves of the rest of the group if the child is within a move group.
+# Moves of the group that were not searched yet are completed with random heroes, so the action always has all heroes of the step.
+def full_action(child, transpositions):
+	action = child.incoming_action
+	while len(child.chosen) != 0 and len(child.children) != 0:
+		child = best_child(child, 0, transpositions)
+		action += child.incoming_action
+	if len(child.chosen) != 0:
+		return child.sub_decision.complete_action()
+	return tuple(sorted(action))
+
+# The node reached from node by action, through the nodes of its move group. None if it is not in the tree.
+def find_child(node, action):
+	remaining = set(action)
+	while len(remaining) != 0:
+		node = next((child for child in node.children if remaining.issuperset(child.incoming_action)), None)
+		if node is None: return None
+		remaining.difference_update(node.incoming_action)
+	return node
+
+# A missing entry is created from the statistics of the node, so an evicted state keeps what this node knows about it.
+def get_transposition(node, transpositions):
+	key = node_key(node)
+	transposition = transpositions.get(key)
+	if transposition == None:
+		transposition = Transposition(node.total_simulated_reward, node.visit_count)
+		transpositions[key] = transposition
+	return transposition
+
+# The reward is flipped whenever the team that moved changes, which is at every node except within move groups.
 def backup(node, reward, transpositions):
+	generation = getattr(transpositions, 'generation', 0)
+	radiant_moved = node.radiant_moved
 	while node != None:
-		node.visit_count += 1
-		
-		key = state_to_key(node.state)
-		transposition = transpositions.get(key)
-		if transposition == None:
-			transposition = Transposition()
-			transpositions[key] = transposition
+		if node.radiant_moved != radiant_moved:
+			reward = 1 - reward
+			radiant_moved = node.radiant_moved
+		transposition = get_transposition(node, transpositions)
 		transposition.visit_count += 1
 		transposition.total_simulated_reward += reward
+		transposition.generation = generation
+
+		node.visit_count += 1
+		node.total_simulated_reward += reward
 		
-		reward = 1 - reward
+		node = node.parent
+
+# Virtual loss counts a pending evaluation as a visit without reward in both the node and its transposition.
+# The transposition is created here if necessary so that best_child can already see the newly expanded leaf.
+def add_virtual_loss(node, amount, transpositions):
+	while node != None:
+		get_transposition(node, transpositions).visit_count += amount
+		node.visit_count += amount
 		node = node.parent
 		
 class Node:
-	def __init__(self, state=State(), incoming_action=None, parent=None, visit_count=0):
+	def __init__(self, state=State(), incoming_action=None, parent=None, visit_count=0, total_simulated_reward=0, chosen=()):
 		self.state = state # s(v)
 		self.incoming_action = incoming_action # a(v)
 		self.parent = parent
 		self.visit_count = visit_count # N(v)
+		# Q(v) of this node alone, only used when its state is not in the transposition table
+		self.total_simulated_reward = total_simulated_reward
 		self.children = list()
-		self.remaining_actions = copy(self.state.get_actions()) if not state.is_terminal() else list()
+		# the heroes chosen so far within the move group of the next action of the state
+		self.chosen = chosen
+		# the team whose reward the node holds
+		self.radiant_moved = state.radiant_moves_next if len(chosen) != 0 else state.radiant_moved()
+		if len(chosen) != 0 or (util.move_groups and not state.is_terminal() and util.pick_ban_order[state.pick_ban_position][1] > 1):
+			self.sub_decision = SubDecision(state, chosen)
+			self.untried_actions = UntriedActions(self.sub_decision)
+		else:
+			self.sub_decision = None
+			self.untried_actions = UntriedActions(state)
 	def expand(self):
-		action = random.choice(self.remaining_actions)
-		self.remaining_actions.remove(action)
-		child = Node(self.state.get_next_state(action), action, self)
+		action = self.untried_actions.pop()
+		if self.sub_decision is None:
+			child = Node(self.state.get_next_state(action), action, self)
+		else:
+			chosen = self.chosen + action
+			if len(chosen) < util.pick_ban_order[self.state.pick_ban_position][1]:
+				child = Node(self.state, action, self, chosen=chosen)
+			else:
+				child = Node(self.state.get_next_state(tuple(sorted(chosen))), action, self)
 		self.children.append(child)
-		return child
\ No newline at end of file
+		return child
+	# the state to start a rollout from, within a move group the rest of the action is chosen randomly
+	def playout_state(self):
+		if len(self.chosen) == 0: return self.state
+		return self.state.get_next_state(self.sub_decision.complete_action())
\ No newline at end of file
@@ -0,0 +1,106 @@
+import multiprocessing
+import random
+import threading
+import time
+
+import mcts
+import mcts_transpositions
+import util
+
+"""
+Parallel versions of mcts_transpositions.uct_search.
+
+Root parallelism runs independent searches of the same position in a pool of processes and adds up the statistics of the root's children.
+Tree parallelism runs several threads on one shared tree and uses virtual loss to keep them from selecting the same path.
+Because of the global interpreter lock, threads only run in parallel while the model evaluates, so root parallelism is the one that scales with cores.
+
+@inproceedings{parallelmcts,
+	author = "Guillaume M. J-B. Chaslot and Mark H. M. Winands and H. Jaap van den Herik",
+	title = "Parallel Monte-Carlo Tree Search",
+	booktitle = "Computers and Games",
+	year = {2008},
+	pages = "60--71"
+}
+"""
+
+# The model is handed to each worker once by the pool initializer instead of with every task.
+worker_model = None
+
+def init_worker(model, pick_ban_order, all_heroes, rollout_policy):
+	global worker_model
+	worker_model = model
+	# the game mode is chosen at runtime so it has to be copied into the workers
+	util.pick_ban_order = pick_ban_order
+	util.all_heroes = all_heroes
+	util.rollout_policy = rollout_policy
+	# the statistics of the root's children are merged by action, so the workers need whole actions
+	util.move_groups = False
+
+def create_pool(model, workers):
+	return multiprocessing.Pool(workers, initializer=init_worker, initargs=(model, util.pick_ban_order, util.all_heroes, util.rollout_policy))
+
+def search_worker(arguments):
+	(state, time_limit, iteration_limit, Cp, rollouts_per_leaf, seed) = arguments
+	random.seed(seed)
+	(_, root_node, transpositions) = mcts_transpositions.uct_search(worker_model, initial_state=state, transpositions=dict(), time_limit=time_limit, iteration_limit=iteration_limit, Cp=Cp, rollouts_per_leaf=rollouts_per_leaf)
+	children = list()
+	for child in root_node.children:
+		transposition = transpositions[mcts_transpositions.node_key(child)]
+		children.append((child.incoming_action, transposition.total_simulated_reward, transposition.visit_count))
+	return (root_node.visit_count, children)
+
+# Each of the workers searches the state with the given time or iteration limit.
+# Returns the best child and a root mcts.Node whose children hold the summed statistics of all workers.
+def root_parallel_search(pool, state, workers, time_limit=None, iteration_limit=None, Cp=2**-5, verbose=False, rollouts_per_leaf=1):
+	assert((time_limit is None) ^ (iteration_limit is None))
+	start_time = time.time()
+	tasks = [(state, time_limit, iteration_limit, Cp, rollouts_per_leaf, random.getrandbits(32)) for _ in range(workers)]
+	root_node = mcts.Node(state)
+	children = dict()
+	for (visit_count, worker_children) in pool.map(search_worker, tasks):
+		root_node.visit_count += visit_count
+		for (action, total_simulated_reward, child_visit_count) in worker_children:
+			child = children.get(action)
+			if child is None:
+				child = mcts.Node(state.get_next_state(action), action, root_node)
+				children[action] = child
+				root_node.children.append(child)
+			child.total_simulated_reward += total_simulated_reward
+			child.visit_count += child_visit_count
+	if verbose: mcts.print_search_speed(root_node.visit_count, time.time() - start_time)
+	best = mcts.best_child(root_node, 0)
+	return (best, root_node)
+
+# Same interface as mcts_transpositions.uct_search with the work split over several threads sharing the tree.
+# The tree is only touched while holding the lock, rollouts and model evaluations run outside of it.
+def tree_parallel_search(model, workers, initial_state=None, initial_node=None, transpositions=None, time_limit=None, iteration_limit=None, Cp=2**-5, verbose=False, widening=None, rollouts_per_leaf=1):
+	assert((initial_state is None) ^ (initial_node is None))
+	assert((time_limit is None) ^ (iteration_limit is None))
+	if transpositions is None: transpositions = mcts_transpositions.TranspositionTable()
+	bounded = isinstance(transpositions, mcts_transpositions.TranspositionTable)
+	root_node = initial_node if initial_node is not None else mcts_transpositions.Node(initial_state)
+	transpositions[mcts_transpositions.node_key(root_node)] = mcts_transpositions.Transposition()
+	lock = threading.Lock()
+	start_time = time.time()
+	# iterations that were started, only accessed while holding the lock
+	started = [0]
+	def work():
+		while True:
+			with lock:
+				if (time.time() - start_time) >= time_limit if iteration_limit is None else started[0] >= iteration_limit:
+					return
+				started[0] += 1
+				# entries whose virtual loss is pending are recreated from their nodes, which carry it as well
+				if bounded: transpositions.evict()
+				node = mcts_transpositions.tree_policy(root_node, Cp, transpositions, widening)
+				mcts_transpositions.add_virtual_loss(node, 1, transpositions)
+			reward = mcts.default_policy(node.playout_state(), model, rollouts_per_leaf)
+			with lock:
+				mcts_transpositions.add_virtual_loss(node, -1, transpositions)
+				mcts_transpositions.backup(node, reward, transpositions)
+	threads = [threading.Thread(target=work) for _ in range(workers)]
+	for thread in threads: thread.start()
+	for thread in threads: thread.join()
+	if verbose: mcts.print_search_speed(started[0], time.time() - start_time)
+	best = mcts_transpositions.best_child(root_node, 0, transpositions)
+	return (best, root_node, transpositions)
\ No newline at end of file
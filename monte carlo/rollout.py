@@ -0,0 +1,152 @@
+import math
+import random
+
+import numpy as np
+
+import gamestate
+import util
+
+"""
+Rollout policies for mcts.random_playout, used instead of uniformly random actions if util.rollout_policy is set.
+
+InformedPolicy plays drafts that look more like real ones: heroes are picked in proportion to how popular and how successful they are on the picking side,
+and banned in proportion to how the opponent would pick them. Candidates are drawn from alias tables in constant time and then accepted with a probability
+that drops with bad synergy with the picked allies and bad matchups against the picked enemies.
+
+random_drafts plays many uniformly random rollouts from the same state at once with numpy, for mcts.uct_search with rollouts_per_leaf.
+"""
+
+# Walker's alias method: draws index i with probability weights[i] / sum(weights) using one random number and a table lookup.
+class AliasTable:
+	__slots__ = ('probability', 'alias', 'size')
+	def __init__(self, weights):
+		size = len(weights)
+		total = sum(weights)
+		assert(total > 0)
+		scaled = [w * size / total for w in weights]
+		self.probability = [1.0] * size
+		self.alias = list(range(size))
+		self.size = size
+		small = [i for i, p in enumerate(scaled) if p < 1]
+		large = [i for i, p in enumerate(scaled) if p >= 1]
+		while small and large:
+			(s, l) = (small.pop(), large.pop())
+			self.probability[s] = scaled[s]
+			self.alias[s] = l
+			scaled[l] -= 1 - scaled[s]
+			(small if scaled[l] < 1 else large).append(l)
+		# what is left is 1 up to rounding errors
+	def sample(self):
+		u = random.random() * self.size
+		i = int(u)
+		return i if u - i < self.probability[i] else self.alias[i]
+
+# Rate with a prior of prior_games games at 0.5, so pairs that were rarely seen stay close to neutral.
+def shrunk_rate(wins, games, prior_games):
+	return (wins + 0.5 * prior_games) / (games + prior_games)
+
+class InformedPolicy:
+	# winrates is a winrates.Winrates.
+	# A hero's weight is proportional to its pick count and grows by a factor of e**(strength * d) for a winrate of 0.5 + d on the picking side.
+	# A candidate pick is accepted with probability e**(pair_strength * s) if s < 0, where s is the summed deviation from 0.5 of its synergy and counter winrates with the picked heroes.
+	def __init__(self, winrates, strength=10.0, pair_strength=10.0, prior_games=20, max_tries=20):
+		self.strength = strength
+		self.pair_strength = pair_strength
+		self.max_tries = max_tries
+		self.pick_counts = winrates.pick_counts.tolist()
+		self.radiant_winrates = winrates.radiant_winrates.tolist()
+		self.dire_winrates = winrates.dire_winrates.tolist()
+		synergy = (shrunk_rate(winrates.ally_wins, winrates.ally_games, prior_games) - 0.5).tolist()
+		counter = (shrunk_rate(winrates.enemy_wins, winrates.enemy_games, prior_games) - 0.5).tolist()
+		# pair scores of a hero with every entry of State.feature_indices, for a radiant and for a dire pick
+		self.radiant_pair_scores = [synergy[h] + counter[h] for h in range(winrates.hero_count)]
+		self.dire_pair_scores = [counter[h] + synergy[h] for h in range(winrates.hero_count)]
+		self.hero_count = winrates.hero_count
+		self.pool_source = None
+		self.tables = None
+	def __getstate__(self):
+		state = dict(self.__dict__)
+		state['pool_source'] = None
+		state['tables'] = None
+		return state
+	# (heroes, alias table) for radiant and for dire picks, rebuilt when util.all_heroes changes
+	def get_tables(self):
+		if self.pool_source is not util.all_heroes:
+			(pool, _) = gamestate.hero_pool()
+			self.tables = tuple((pool, AliasTable([(self.pick_counts[h] + 1) * math.exp(self.strength * (winrates[h] - 0.5)) for h in pool])) for winrates in (self.radiant_winrates, self.dire_winrates))
+			self.pool_source = util.all_heroes
+		return self.tables
+	def choose_action(self, state):
+		(pick_ban, count) = util.pick_ban_order[state.pick_ban_position]
+		radiant_moves = state.radiant_moves_next
+		picks = pick_ban == util.pick
+		# a team bans the heroes the other team would pick
+		(heroes, table) = self.get_tables()[0 if radiant_moves == picks else 1]
+		if picks:
+			(pair_scores, offset) = (self.radiant_pair_scores, 0) if radiant_moves else (self.dire_pair_scores, self.hero_count)
+			# the heroes picked so far, as indices into the pair scores
+			picked = list(state.feature_indices)
+		unavailable = state.unavailable_mask()
+		action = list()
+		tries = 0
+		while len(action) < count:
+			if tries == self.max_tries:
+				# nearly all of the likely heroes are gone, fall back to a uniform choice
+				remaining = [h for h in gamestate.hero_pool()[0] if not unavailable & (1 << h)]
+				action.extend(random.sample(remaining, count - len(action)))
+				break
+			tries += 1
+			hero = heroes[table.sample()]
+			bit = 1 << hero
+			if unavailable & bit:
+				continue
+			if picks:
+				score = sum(map(pair_scores[hero].__getitem__, picked))
+				if score < 0 and random.random() >= math.exp(self.pair_strength * score):
+					continue
+				picked.append(offset + hero)
+			unavailable |= bit
+			action.append(hero)
+			tries = 0
+		if count > 1: action.sort()
+		return tuple(action)
+
+# The positions in a shuffled list of the available heroes that the remaining picks of radiant and of dire get when the heroes are dealt out in draft order, and the number of heroes dealt.
+def pick_slots(state):
+	(radiant_slots, dire_slots) = (list(), list())
+	radiant_moves = state.radiant_moves_next
+	slot = 0
+	for (pick_ban, count) in util.pick_ban_order[state.pick_ban_position:]:
+		if pick_ban == util.pick:
+			(radiant_slots if radiant_moves else dire_slots).extend(range(slot, slot + count))
+		slot += count
+		radiant_moves = not radiant_moves
+	return (radiant_slots, dire_slots, slot)
+
+# The hero pool of gamestate.hero_pool as an array of flags indexed by ordered hero id, cached the same way.
+_pool_source = None
+_pool_flags = None
+def pool_flags():
+	global _pool_source, _pool_flags
+	if util.all_heroes is not _pool_source:
+		_pool_flags = np.zeros(util.hero_count, dtype=bool)
+		_pool_flags[list(gamestate.hero_pool()[0])] = True
+		_pool_source = util.all_heroes
+	return _pool_flags
+
+# count uniformly random completions of the draft of the state, as the rows of a feature matrix like util.state_to_feature.
+# Every row gets its own permutation of the available heroes, which is dealt out to the remaining picks and bans. The bans are dropped.
+# The permutations sort random numbers from a generator seeded from random, so random.seed makes them repeatable.
+def random_drafts(state, count):
+	available = pool_flags().copy()
+	available[gamestate.mask_to_heroes(state.unavailable_mask())] = False
+	available = np.flatnonzero(available)
+	(radiant_slots, dire_slots, dealt) = pick_slots(state)
+	generator = np.random.default_rng(random.getrandbits(64))
+	heroes = available[np.argsort(generator.random((count, len(available))), axis=1)[:, :dealt]]
+	features = np.zeros((count, 2 * util.hero_count))
+	features[:, list(state.feature_indices)] = 1.0
+	rows = np.arange(count)[:, np.newaxis]
+	features[rows, heroes[:, radiant_slots]] = 1.0
+	features[rows, util.hero_count + heroes[:, dire_slots]] = 1.0
+	return features
\ No newline at end of file
@@ -0,0 +1,311 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future, TimeoutError
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import mcts_transpositions
+import util
+from gamestate import State
+
+"""
+Local HTTP/JSON service that recommends picks and bans for many drafts at once.
+
+Every draft is a session with its own mcts_transpositions tree and transposition table, which is kept between requests and searched further in the background while the session waits for its next request.
+Sessions live in a pool of worker processes that each load the model once. A worker runs the searches of its sessions one at a time, so util.pick_ban_order can be switched to the game mode of the session being searched.
+
+Run from the repository root like main.py:
+python "monte carlo/server.py" --port 8000 model
+
+POST /sessions {"mode": "ap" or "cm", "radiant_first": true}
+	Start a draft. Returns the session as below, with its id.
+GET /sessions/<id>
+	The heroes picked and banned so far, the next step of the draft and the number of simulations in the tree.
+POST /sessions/<id>/events {"heroes": ["axe"]}
+	The next pick or ban of the draft. Heroes are names or ordered hero ids. Returns the session.
+GET /sessions/<id>/recommendations?time=1.0&count=10
+	Search for time seconds and return the count best actions for the team that moves next.
+DELETE /sessions/<id>
+	End the draft.
+"""
+
+class Session:
+	def __init__(self, mode, radiant_first, max_memory=None):
+		self.order = util.allpick_order if mode == "ap" else util.cm_order
+		self.Cp = util.allpick_cp if mode == "ap" else util.cm_cp
+		self.mode = mode
+		self.node = mcts_transpositions.Node(State(radiant_first))
+		self.transpositions = mcts_transpositions.TranspositionTable(max_memory)
+		self.last_used = time.time()
+	def search(self, model, time_limit=None, iteration_limit=None):
+		util.pick_ban_order = self.order
+		mcts_transpositions.uct_search(model, initial_node=self.node, transpositions=self.transpositions, time_limit=time_limit, iteration_limit=iteration_limit, Cp=self.Cp)
+	def apply(self, heroes):
+		state = self.node.state
+		if state.is_terminal():
+			raise ValueError("The draft is complete.")
+		(_, count) = self.order[state.pick_ban_position]
+		action = tuple(sorted(hero_id(hero) for hero in heroes))
+		if len(action) != count or len(set(action)) != count:
+			raise ValueError("The next step of the draft takes {} different heroes.".format(count))
+		for hero in action:
+			if state.unavailable_mask() & (1 << hero):
+				raise ValueError("Hero {} is already picked or banned.".format(util.simple_heroes.ordered_to_name(hero)))
+		util.pick_ban_order = self.order
+		# keep the subtree of the action if it was searched
+		for child in self.node.children:
+			if child.incoming_action == action:
+				child.parent = None
+				child.incoming_action = None
+				self.node = child
+				break
+		else:
+			self.node = mcts_transpositions.Node(state.get_next_state(action))
+		self.transpositions.new_move(self.node)
+	def describe(self):
+		state = self.node.state
+		if state.is_terminal():
+			next_step = None
+		else:
+			(pick_ban, count) = self.order[state.pick_ban_position]
+			next_step = {"action": "pick" if pick_ban == util.pick else "ban", "count": count, "team": "radiant" if state.radiant_moves_next else "dire"}
+		return {
+			"mode": self.mode,
+			"radiant": heroes_to_json(state.radiant_heroes),
+			"dire": heroes_to_json(state.dire_heroes),
+			"banned": heroes_to_json(state.banned_heroes),
+			"next": next_step,
+			"simulations": self.node.visit_count,
+			"transpositions": len(self.transpositions),
+			"transposition_memory": self.transpositions.memory(),
+		}
+	def recommendations(self, count):
+		def statistics(child):
+			transposition = mcts_transpositions.get_statistics(child, self.transpositions)
+			return (transposition.total_simulated_reward / transposition.visit_count, transposition.visit_count)
+		ranked = sorted(((statistics(child), child.incoming_action) for child in self.node.children if child.visit_count != 0), reverse=True)
+		return [{"heroes": heroes_to_json(action), "value": value, "visits": visits} for ((value, visits), action) in ranked[:count]]
+
+def hero_id(hero):
+	if isinstance(hero, int) and not isinstance(hero, bool):
+		if hero not in util.all_heroes:
+			raise ValueError("{} is not an ordered hero id.".format(hero))
+		return hero
+	id = util.simple_heroes.approximate_name_to_ordered(str(hero))
+	if id is None:
+		raise ValueError("Could not find hero {}.".format(hero))
+	return id
+
+def heroes_to_json(heroes):
+	return [{"id": i, "name": util.simple_heroes.ordered_to_name(i)} for i in sorted(heroes)]
+
+# Runs in each worker process. Answers the commands of the server and searches the trees of its sessions in slices of slice_time seconds while there are none.
+# Background search of a session stops once its tree has max_simulations simulations. Sessions that were not used for session_timeout seconds are deleted
+# and reported to the server with a result without request id. The transposition table of every session is limited to transposition_memory bytes.
+def worker_main(model_name, commands, results, slice_time, max_simulations, session_timeout, transposition_memory):
+	model = util.load_model(model_name)
+	sessions = dict()
+	# round robin over the sessions to search in the background
+	pondering = iter(())
+	# sessions are deleted at most this many seconds after their timeout, also by workers that wait for commands
+	expiry_interval = session_timeout / 10
+	last_expiry = time.time()
+	while True:
+		if time.time() - last_expiry > expiry_interval:
+			expired = [i for i, s in sessions.items() if time.time() - s.last_used > session_timeout]
+			for session_id in expired:
+				del sessions[session_id]
+			if len(expired) != 0:
+				results.put((None, "expired", expired))
+			last_expiry = time.time()
+		growing = [s for s in sessions.values() if not s.node.state.is_terminal() and s.node.visit_count < max_simulations]
+		try:
+			command = commands.get(timeout=expiry_interval) if len(growing) == 0 else commands.get_nowait()
+		except queue.Empty:
+			session = next(pondering, None)
+			if session is None:
+				pondering = iter(growing)
+			elif session in growing:
+				session.search(model, time_limit=slice_time)
+			continue
+		if command is None:
+			return
+		(request_id, name, session_id, arguments) = command
+		if name == "create":
+			sessions[session_id] = Session(*arguments, transposition_memory)
+		session = sessions.get(session_id)
+		if session is None:
+			results.put((request_id, 404, {"error": "Unknown session {}.".format(session_id)}))
+			continue
+		try:
+			session.last_used = time.time()
+			if name == "events":
+				session.apply(*arguments)
+			elif name == "recommendations":
+				(time_limit, count) = arguments
+				if time_limit > 0 and not session.node.state.is_terminal():
+					session.search(model, time_limit=time_limit)
+				results.put((request_id, 200, {"recommendations": session.recommendations(count), "simulations": session.node.visit_count}))
+				continue
+			elif name == "delete":
+				del sessions[session_id]
+				results.put((request_id, 200, {"deleted": session_id}))
+				continue
+			results.put((request_id, 200, dict(session.describe(), session=session_id)))
+		except ValueError as e:
+			results.put((request_id, 400, {"error": str(e)}))
+		except Exception as e:
+			# the worker keeps serving its other sessions
+			results.put((request_id, 500, {"error": "{}: {}".format(type(e).__name__, e)}))
+
+class RecommendationServer:
+	"""
+	Starts the worker processes and serves their sessions over HTTP. Sessions are assigned to the worker with the fewest sessions.
+	
+	Requests that a worker does not answer within request_timeout seconds (plus the search time of recommendations) fail with status 504, so a dead or stuck worker does not hang the HTTP threads.
+	"""
+	def __init__(self, model_name, workers=4, host="127.0.0.1", port=8000, slice_time=0.05, max_simulations=1000000, session_timeout=3600, transposition_memory=None, request_timeout=60):
+		self.results = multiprocessing.Queue()
+		self.commands = [multiprocessing.Queue() for _ in range(workers)]
+		self.processes = [multiprocessing.Process(target=worker_main, args=(model_name, commands, self.results, slice_time, max_simulations, session_timeout, transposition_memory), daemon=True) for commands in self.commands]
+		self.lock = threading.Lock()
+		self.request_ids = itertools.count()
+		self.pending = dict()
+		self.request_timeout = request_timeout
+		# worker index of every session, sessions that expire in their worker are removed by dispatch
+		self.sessions = dict()
+		self.httpd = ThreadingHTTPServer((host, port), make_handler(self))
+		self.url = "http://{}:{}".format(*self.httpd.server_address[:2])
+		self.dispatcher = threading.Thread(target=self.dispatch, daemon=True)
+	def start(self):
+		for process in self.processes: process.start()
+		self.dispatcher.start()
+		threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+	def stop(self):
+		self.httpd.shutdown()
+		self.httpd.server_close()
+		for commands in self.commands: commands.put(None)
+		for process in self.processes: process.join()
+		self.results.put(None)
+		self.dispatcher.join()
+	def dispatch(self):
+		while True:
+			result = self.results.get()
+			if result is None:
+				return
+			(request_id, status, value) = result
+			with self.lock:
+				if request_id is None:
+					for session_id in value: self.sessions.pop(session_id, None)
+					continue
+				# None if the request already timed out
+				future = self.pending.pop(request_id, None)
+			if future is not None:
+				future.set_result((status, value))
+	# Sends a command for the session to its worker and waits for the answer, by default for request_timeout seconds. Returns (http status, json value).
+	def call(self, name, session_id, *arguments, timeout=None):
+		with self.lock:
+			if name == "create":
+				counts = [0] * len(self.commands)
+				for worker in self.sessions.values(): counts[worker] += 1
+				self.sessions[session_id] = counts.index(min(counts))
+			worker = self.sessions.get(session_id)
+			if worker is None:
+				return (404, {"error": "Unknown session {}.".format(session_id)})
+			if name == "delete":
+				del self.sessions[session_id]
+			request_id = next(self.request_ids)
+			future = Future()
+			self.pending[request_id] = future
+		self.commands[worker].put((request_id, name, session_id, arguments))
+		try:
+			return future.result(self.request_timeout if timeout is None else timeout)
+		except TimeoutError:
+			with self.lock:
+				self.pending.pop(request_id, None)
+			if not self.processes[worker].is_alive():
+				return (503, {"error": "The worker of session {} has stopped.".format(session_id)})
+			return (504, {"error": "The worker of session {} did not answer in time.".format(session_id)})
+
+def make_handler(server):
+	class Handler(BaseHTTPRequestHandler):
+		def send_json(self, status, value):
+			body = json.dumps(value).encode()
+			self.send_response(status)
+			self.send_header("Content-Type", "application/json")
+			self.send_header("Content-Length", str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+		def read_json(self):
+			length = int(self.headers.get("Content-Length", 0))
+			return json.loads(self.rfile.read(length)) if length != 0 else dict()
+		def route(self):
+			url = urlparse(self.path)
+			parts = [part for part in url.path.split("/") if part]
+			return (parts, parse_qs(url.query))
+		def do_GET(self):
+			(parts, query) = self.route()
+			if len(parts) == 2 and parts[0] == "sessions":
+				self.send_json(*server.call("describe", parts[1]))
+			elif len(parts) == 3 and parts[0] == "sessions" and parts[2] == "recommendations":
+				try:
+					time_limit = float(query.get("time", ["1.0"])[0])
+					count = int(query.get("count", ["10"])[0])
+				except ValueError:
+					return self.send_json(400, {"error": "time and count have to be numbers."})
+				self.send_json(*server.call("recommendations", parts[1], time_limit, count, timeout=server.request_timeout + max(time_limit, 0)))
+			else:
+				self.send_json(404, {"error": "Not found."})
+		def do_POST(self):
+			(parts, _) = self.route()
+			try:
+				body = self.read_json()
+			except ValueError:
+				return self.send_json(400, {"error": "The body is not valid JSON."})
+			if parts == ["sessions"]:
+				mode = body.get("mode", "ap")
+				if mode not in ("ap", "cm"):
+					return self.send_json(400, {"error": "mode has to be ap or cm."})
+				self.send_json(*server.call("create", uuid.uuid4().hex, mode, bool(body.get("radiant_first", True))))
+			elif len(parts) == 3 and parts[0] == "sessions" and parts[2] == "events":
+				heroes = body.get("heroes")
+				if not isinstance(heroes, list):
+					return self.send_json(400, {"error": "heroes has to be a list."})
+				self.send_json(*server.call("events", parts[1], heroes))
+			else:
+				self.send_json(404, {"error": "Not found."})
+		def do_DELETE(self):
+			(parts, _) = self.route()
+			if len(parts) == 2 and parts[0] == "sessions":
+				self.send_json(*server.call("delete", parts[1]))
+			else:
+				self.send_json(404, {"error": "Not found."})
+		def log_message(self, format, *args):
+			pass
+	return Handler
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Serve pick and ban recommendations over HTTP.")
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=8000)
+	parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count(), help="Number of worker processes. Each loads the model and searches the sessions assigned to it.")
+	parser.add_argument("--slice-time", type=float, default=0.05, help="Seconds a session is searched in the background before the worker turns to the next one.")
+	parser.add_argument("--max-simulations", type=int, default=1000000, help="Sessions are not searched in the background once their tree has this many simulations.")
+	parser.add_argument("--session-timeout", type=float, default=3600, help="Sessions are deleted after this many seconds without a request.")
+	parser.add_argument("--transposition-memory", type=float, default=256, help="Memory limit of the transposition table of every session in MB.")
+	parser.add_argument("--request-timeout", type=float, default=60, help="Requests fail if their worker does not answer within this many seconds, not counting the search time of recommendations.")
+	parser.add_argument("model", help="Name of the model in the data directory.")
+	args = parser.parse_args()
+	server = RecommendationServer(args.model, args.workers, args.host, args.port, args.slice_time, args.max_simulations, args.session_timeout, int(args.transposition_memory * 2**20), args.request_timeout)
+	server.start()
+	print("Serving recommendations on", server.url)
+	try:
+		while True: time.sleep(3600)
+	except KeyboardInterrupt:
+		server.stop()
\ No newline at end of file
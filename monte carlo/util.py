@@ -1,5 +1,6 @@
-from sklearn.externals import joblib
+import numpy as np
 import random
+import threading
 
 import importlib.util
 spec = importlib.util.spec_from_file_location("simple_heroes", "machine learning/simple_heroes.py")
@@ -9,13 +10,49 @@ spec.loader.exec_module(simple_heroes)
 # list of names of all available machine learning models
 all_models = []
 
-def load_model(name):
-	model = joblib.load("data/{}/{}.model".format(name, name))
+# Linear models are replaced by an equivalent evaluators.LinearEvaluator unless compile is False.
+# With mmap_mode the numpy arrays of the model (for example the nodes of the trees of a forest) are memory mapped instead of read, which only works for uncompressed model files.
+def load_model(name, compile=True, mmap_mode='r'):
+	# imported here because it takes most of the startup time, it imports scikit-learn
+	try:
+		from sklearn.externals import joblib
+	except ImportError:
+		import joblib
+	model = joblib.load("data/{}/{}.model".format(name, name), mmap_mode=mmap_mode)
 	model.n_jobs = 1 #for some reason setting n_jobs to 1 makes single predictions much faster.
+	if compile:
+		# imported here because evaluators imports gamestate, which imports this module
+		import evaluators
+		model = evaluators.compile_model(model, len(simple_heroes.dota_hero_ids))
 	return model
+
+# Loads models with load_model in a background thread, one after the other in the given order.
+# get waits until the model is loaded and raises the exception of load_model if it failed.
+class ModelLoader:
+	def __init__(self, names, compile=True):
+		self.names = list(names)
+		self.compile = compile
+		self.models = dict()
+		self.errors = dict()
+		self.loaded = {name: threading.Event() for name in self.names}
+		self.thread = threading.Thread(target=self.run, daemon=True)
+		self.thread.start()
+	def run(self):
+		for name in self.names:
+			try:
+				self.models[name] = load_model(name, self.compile)
+			except Exception as e:
+				self.errors[name] = e
+			self.loaded[name].set()
+	def get(self, name):
+		self.loaded[name].wait()
+		if name in self.errors:
+			raise self.errors[name]
+		return self.models[name]
 	
 orig_all_heroes = set([simple_heroes.real_to_ordered(i) for i in simple_heroes.dota_hero_ids])
 all_heroes = set([simple_heroes.real_to_ordered(i) for i in simple_heroes.dota_hero_ids])
+hero_count = len(simple_heroes.dota_hero_ids)
 team_size = 5
 # enum values for pick and ban
 pick = 0
@@ -40,6 +77,12 @@ transpo_cp = 2**-5
 #pick_ban_order = randomdraft_order
 pick_ban_order = cm_order
 
+# policy used to complete drafts in the rollouts, see rollout.py. None chooses uniformly random actions.
+rollout_policy = None
+
+# whether the trees of mcts_transpositions split actions of several heroes into one decision per hero (move groups)
+move_groups = False
+
 def make_random_pool(pool_size=50):
 	all_heroes = [simple_heroes.real_to_ordered(i) for i in simple_heroes.dota_hero_ids]
 	random.shuffle(all_heroes)
@@ -49,19 +92,50 @@ def make_random_pool(pool_size=50):
 # all_heroes = make_random_pool()
 
 # convert mcts state to feature vector
+# the first hero_count entries are the radiant heroes, the others the dire heroes
 def state_to_feature(state):
-	radiant_heroes = [0.0] * len(simple_heroes.dota_hero_ids)
-	dire_heroes = [0.0] * len(simple_heroes.dota_hero_ids)
-	for i in state.radiant_heroes: radiant_heroes[i] = 1.0
-	for i in state.dire_heroes: dire_heroes[i] = 1.0
-	feature = radiant_heroes + dire_heroes
+	feature = np.zeros(2 * hero_count)
+	feature[list(state.feature_indices)] = 1.0
 	return feature
 
+# Feature matrix reused by every evaluation of states, grown when a larger batch comes along.
+# Only the entries of the evaluated states are set and they are cleared again afterwards, so it stays all zeros between calls.
+# Every thread has its own, the threads of parallel.tree_parallel_search evaluate at the same time and models like those of scikit-learn release the GIL while predicting.
+feature_buffers = threading.local()
+
+def predict_states_with_buffer(states, model):
+	feature_buffer = getattr(feature_buffers, 'buffer', None)
+	if feature_buffer is None or len(states) > len(feature_buffer):
+		feature_buffer = feature_buffers.buffer = np.zeros((max(1, len(states)), 2 * hero_count))
+	features = feature_buffer[:len(states)]
+	rows = np.repeat(np.arange(len(states)), [len(state.feature_indices) for state in states])
+	columns = np.fromiter((i for state in states for i in state.feature_indices), dtype=np.intp, count=len(rows))
+	features[rows, columns] = 1.0
+	try:
+		return [radiant_win for radiant_win, dire_win in model.predict_proba(features)]
+	finally:
+		features[rows, columns] = 0.0
+
 def predict_radiant_win_probability(feature, model):
-	radiant_win, dire_win = model.predict_proba([feature])[0]
+	radiant_win, dire_win = model.predict_proba(np.reshape(feature, (1, -1)))[0]
 	#return (radiant_win + (1 - dire_win)) / 2
 	return radiant_win
 
+# predict_radiant_win_probability for a list of features using one call to the model
+def predict_radiant_win_probabilities(features, model):
+	return [radiant_win for radiant_win, dire_win in model.predict_proba(features)]
+
+# Evaluators (see evaluators.py) predict directly from the state, other models get a feature vector.
+def predict_state_radiant_win_probability(state, model):
+	if hasattr(model, 'radiant_win_probability'):
+		return model.radiant_win_probability(state)
+	return predict_states_with_buffer((state,), model)[0]
+
+def predict_state_radiant_win_probabilities(states, model):
+	if hasattr(model, 'radiant_win_probabilities'):
+		return model.radiant_win_probabilities(states)
+	return predict_states_with_buffer(states, model)
+
 def print_tree(node, indent=''):
 	print(indent + "Q:", node.total_simulated_reward, "N:", node.visit_count)
 	print(indent + "State:", node.state.str())
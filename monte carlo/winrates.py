@@ -1,34 +1,150 @@
+import os
 import sqlite3
-import simple_heroes
-import random
 
+import numpy as np
+
+import util
+
+simple_heroes = util.simple_heroes
+
+hero_columns = 'radiant_hero_1,radiant_hero_2,radiant_hero_3,radiant_hero_4,radiant_hero_5, dire_hero_1,dire_hero_2,dire_hero_3,dire_hero_4,dire_hero_5'
+complete_matches = 'radiant_win IS NOT NULL AND radiant_hero_1 != 0 AND radiant_hero_2 != 0 AND radiant_hero_3 != 0 AND radiant_hero_4 != 0 AND radiant_hero_5 != 0 AND dire_hero_1 != 0 AND dire_hero_2 != 0 AND dire_hero_3 != 0 AND dire_hero_4 != 0 AND dire_hero_5 != 0'
+
+# index pairs of the 10 heroes of a match: two heroes of the same team and a radiant hero against a dire hero
+ally_pairs = np.array([(i, j) for team in (range(5), range(5, 10)) for i in team for j in team if i < j])
+enemy_pairs = np.array([(i, j) for i in range(5) for j in range(5, 10)])
+
+# Per hero and hero pair statistics of a set of matches, indexed by ordered hero id.
+# All counts are gathered in one scan of the database and kept up to date with update, which only reads matches it has not counted yet.
+# The winrates of heroes or pairs without matches are 0.5.
 class Winrates:
-	def load_winrates(self, database="data/matches.sqlite"):
+	def __init__(self, hero_count=len(simple_heroes.dota_hero_ids)):
+		self.hero_count = hero_count
+		self.match_count = 0
+		self.radiant_games = np.zeros(hero_count, dtype=np.int64)
+		self.radiant_wins = np.zeros(hero_count, dtype=np.int64)
+		self.dire_games = np.zeros(hero_count, dtype=np.int64)
+		self.dire_wins = np.zeros(hero_count, dtype=np.int64)
+		# [a, b]: matches with a and b in the same team, and how many of those that team won. Symmetric.
+		self.ally_games = np.zeros((hero_count, hero_count), dtype=np.int64)
+		self.ally_wins = np.zeros((hero_count, hero_count), dtype=np.int64)
+		# [a, b]: matches with a against b, and how many of those the team of a won. enemy_wins + enemy_wins.T == enemy_games.
+		self.enemy_games = np.zeros((hero_count, hero_count), dtype=np.int64)
+		self.enemy_wins = np.zeros((hero_count, hero_count), dtype=np.int64)
+		# seq of the last entry of the completed_matches log of the database that was counted
+		self.log_position = 0
+	# heroes is an array with the 5 radiant and 5 dire ordered hero ids of each match
+	def add_matches(self, radiant_won, heroes):
+		radiant_won = np.asarray(radiant_won, dtype=bool)
+		heroes = np.asarray(heroes, dtype=np.int64)
+		n = self.hero_count
+		self.match_count += len(heroes)
+		(radiant, dire) = (heroes[:, :5].ravel(), heroes[:, 5:].ravel())
+		self.radiant_games += np.bincount(radiant, minlength=n)
+		self.radiant_wins += np.bincount(radiant, weights=np.repeat(radiant_won, 5), minlength=n).astype(np.int64)
+		self.dire_games += np.bincount(dire, minlength=n)
+		self.dire_wins += np.bincount(dire, weights=np.repeat(~radiant_won, 5), minlength=n).astype(np.int64)
+		# the pairs are counted in one direction and mirrored
+		(a, b) = (heroes[:, ally_pairs[:, 0]].ravel(), heroes[:, ally_pairs[:, 1]].ravel())
+		team_won = np.where(ally_pairs[:, 0] < 5, radiant_won[:, np.newaxis], ~radiant_won[:, np.newaxis]).ravel()
+		games = np.bincount(a * n + b, minlength=n * n).reshape(n, n)
+		wins = np.bincount(a * n + b, weights=team_won, minlength=n * n).astype(np.int64).reshape(n, n)
+		self.ally_games += games + games.T
+		self.ally_wins += wins + wins.T
+		(a, b) = (heroes[:, enemy_pairs[:, 0]].ravel(), heroes[:, enemy_pairs[:, 1]].ravel())
+		games = np.bincount(a * n + b, minlength=n * n).reshape(n, n)
+		wins = np.bincount(a * n + b, weights=np.repeat(radiant_won, len(enemy_pairs)), minlength=n * n).astype(np.int64).reshape(n, n)
+		self.enemy_games += games + games.T
+		self.enemy_wins += wins + (games - wins).T
+	# Count the complete matches of the table that have not been counted yet. Returns the number of new matches.
+	# Matches do not become complete in the order of their ids, so like in match_store.append_from_database the completed_matches log of the database
+	# (see get_data.create_match_log) is read from the last seq that was counted on. Without the log all matches are counted again.
+	# The statistics are not built from the binary match store: it has no lobby or skill columns to select the matches of table, and only the new matches are read here anyway.
+	def update(self, database, table='VeryHighSkillGames', chunk_size=100000):
 		connection = sqlite3.connect(database)
-		self.radiant_winrates = dict()
-		self.dire_winrates = dict()
-		for hero in simple_heroes.dota_hero_ids:
-			matches_on_radiant = connection.execute('SELECT COUNT(match_id) as wins FROM VeryHighSkillGames WHERE radiant_hero_1 = ? OR radiant_hero_2 = ? OR radiant_hero_3 = ? OR radiant_hero_4 = ? OR radiant_hero_5 = ? GROUP BY radiant_win', (hero,) * 5).fetchall()
-			assert(len(matches_on_radiant) == 2)
-			((dire_wins,), (radiant_wins,)) = matches_on_radiant
-			total_matches = dire_wins + radiant_wins
-			winrate_on_radiant = radiant_wins / total_matches
-
-			matches_on_dire = connection.execute('SELECT COUNT(match_id) as wins FROM VeryHighSkillGames WHERE dire_hero_1 = ? OR dire_hero_2 = ? OR dire_hero_3 = ? OR dire_hero_4 = ? OR dire_hero_5 = ? GROUP BY radiant_win', (hero,) * 5).fetchall()
-			assert(len(matches_on_dire) == 2)
-			((dire_wins,), (radiant_wins,)) = matches_on_dire
-			total_matches = dire_wins + radiant_wins
-			winrate_on_dire = dire_wins / total_matches
-
-			self.radiant_winrates[simple_heroes.real_to_ordered(hero)] = winrate_on_radiant
-			self.dire_winrates[simple_heroes.real_to_ordered(hero)] = winrate_on_dire
-
-		self.sorted_radiant_ids = sorted(self.radiant_winrates, key=lambda x: self.radiant_winrates[x])
-		self.sorted_dire_ids = sorted(self.dire_winrates, key=lambda x: self.dire_winrates[x])
+		if connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'completed_matches'").fetchone() is not None:
+			# read before the matches, so that matches which become complete while we read are counted next time
+			(newest,) = connection.execute('SELECT MAX(seq) FROM completed_matches').fetchone()
+			newest = newest or 0
+			cursor = connection.execute('SELECT radiant_win, ' + hero_columns + ' FROM ' + table + ' WHERE match_id IN (SELECT match_id FROM completed_matches WHERE seq > ? AND seq <= ?) AND ' + complete_matches, (self.log_position, newest))
+		else:
+			self.__init__(self.hero_count)
+			newest = 0
+			cursor = connection.execute('SELECT radiant_win, ' + hero_columns + ' FROM ' + table + ' WHERE ' + complete_matches)
+		added = 0
+		while True:
+			rows = cursor.fetchmany(chunk_size)
+			if len(rows) == 0: break
+			rows = np.array(rows, dtype=np.int64)
+			self.add_matches(rows[:, 0] != 0, simple_heroes.real_to_ordered_array(rows[:, 1:]))
+			added += len(rows)
+		connection.close()
+		self.log_position = newest
+		return added
+	# for compatibility, recounts all matches of the database
+	def load_winrates(self, database='data/matches.sqlite'):
+		self.__init__(self.hero_count)
+		self.update(database)
+	def save(self, path):
+		np.savez(path, **{name: np.asarray(value) for name, value in vars(self).items()})
+	# Raises ValueError if the file does not hold exactly the attributes of a Winrates.
+	@staticmethod
+	def load(path):
+		winrates = Winrates.__new__(Winrates)
+		with np.load(path) as f:
+			if set(f.files) != set(vars(Winrates(0))):
+				raise ValueError('{} is not a cache of Winrates.'.format(path))
+			for name in f.files:
+				setattr(winrates, name, f[name] if f[name].ndim != 0 else f[name].item())
+		return winrates
+	@property
+	def pick_counts(self):
+		return self.radiant_games + self.dire_games
+	@property
+	def radiant_winrates(self):
+		return rate(self.radiant_wins, self.radiant_games)
+	@property
+	def dire_winrates(self):
+		return rate(self.dire_wins, self.dire_games)
+	@property
+	def overall_winrates(self):
+		return rate(self.radiant_wins + self.dire_wins, self.pick_counts)
+	# winrate of a and b when they are in the same team
+	@property
+	def synergy(self):
+		return rate(self.ally_wins, self.ally_games)
+	# winrate of a against b
+	@property
+	def counter(self):
+		return rate(self.enemy_wins, self.enemy_games)
+	@property
+	def sorted_radiant_ids(self):
+		return np.argsort(self.radiant_winrates, kind='stable').tolist()
+	@property
+	def sorted_dire_ids(self):
+		return np.argsort(self.dire_winrates, kind='stable').tolist()
 	def print_winrates(self):
-		for hero in range(len(simple_heroes.dota_hero_ids)):
+		for hero in range(self.hero_count):
 			print(simple_heroes.ordered_to_name(hero), self.radiant_winrates[hero], self.dire_winrates[hero])
 
-# Load one global winrates instance
-winrates = Winrates()
-winrates.load_winrates()
\ No newline at end of file
+def rate(wins, games):
+	return np.divide(wins, games, out=np.full(np.shape(games), 0.5), where=games != 0)
+
+# Load the statistics cached at path and count the new matches of the database into them, or count all matches if there is no usable cache.
+# The cache is written back if there were new matches.
+def load(path='data/winrates.npz', database='data/matches.sqlite', table='VeryHighSkillGames'):
+	try:
+		winrates = Winrates.load(path) if os.path.exists(path) else Winrates()
+	except ValueError:
+		winrates = Winrates()
+	if os.path.exists(database) and winrates.update(database, table) != 0:
+		winrates.save(path)
+	return winrates
+
+# The global instance winrates.winrates is only loaded when it is first used, so importing this module does not touch the database.
+def __getattr__(name):
+	global winrates
+	if name == 'winrates':
+		winrates = load()
+		return winrates
+	raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
\ No newline at end of file